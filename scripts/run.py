@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from src.models.cities import SquareCity
 from src.simulator.simulation import Simulation
+from src.simulator.engine import SimulatorEngine
+from src.simulator.fleet_engine import FleetSimulatorEngine
 import sys
 from multiprocessing import Pool
 import multiprocessing
@@ -21,6 +23,9 @@ with open(args.paramsfile, "r") as f:
     for k, v in parameters.items():
         globals()[k] = v
 
+# Engine used to compute the steps of the simulation.
+ENGINES = {"objects": SimulatorEngine, "fleet": FleetSimulatorEngine}
+
 # Read the number of cores to use from the command line.
 NUM_PROCESS = args.nprocess
 
@@ -59,12 +64,14 @@ def run_simulation_with(args):
     simulation.set_idle_distribution(upper=IDLE_UPPER,
                                     lower=IDLE_LOWER, std=IDLE_STD)
     # Create the city
-    simulation.create_city(SquareCity, RB_LENGTH, AV_LENGTH, INTERSEC_LENGTH, SCALE) 
+    simulation.create_city(SquareCity, RB_LENGTH=RB_LENGTH, AV_LENGTH=AV_LENGTH, SCALE=SCALE,
+                           INTERSEC_LENGTH=INTERSEC_LENGTH, cache=CITY_CACHE)
 
     simulation.stations_placement(min_plugs_per_station=MIN_PLUGS_PER_STATION,
-                                min_num_stations=MIN_D_STATIONS)
+                                min_num_stations=MIN_D_STATIONS, cache=CITY_CACHE,
+                                influence=STATIONS_INFLUENCE)
     # Create the simulator
-    simulation.create_simulator()
+    simulation.create_simulator(ENGINES[ENGINE], router=ROUTER)
 
     # Run the simulation
     simulation.run(total_time=TOTAL_TIME,
@@ -1,53 +1,126 @@
 # -*- coding: utf-8 -*-
+from src.metrics.writers import StreamWriter
 from src.models.states import States
-from src.simulator.cythonGraphFunctions import lattice_distance
 
 import copy
 import numpy as np
 import h5py
 
 
+# Values of the moving states. Comparing with each value is faster than
+# indexing a table of flags with the states.
+MOVING_STATES = [s.value for s in States.moving_states()]
+
+
 class SimulationSnapshot(object):
 
-    def __init__(self, vehicles):
+    def __init__(self, state, cell, pos, SIZE, work=None):
+        """Position and state of every vehicle at a time step.
+
+        :param state: uint8 array with the value of the state of each vehicle.
+        :param cell: int32 array with the id of the cell of each vehicle.
+        :param pos: int32 array (2, n) with the coordinates of each vehicle,
+        x_pos and y_pos are its rows.
+        :param SIZE: side of the city, the distances wrap around the borders.
+        :param work: arrays used to compute mean_velocities(), see
+        SimulationSnapshot.work_arrays(). Snapshots of the same vehicles can
+        share them.
+        """
         super().__init__()
-        # For each vehicle, store its position and state
-        self.x_pos, self.y_pos, self.state = [], [], []
-        for v in vehicles:
-            self.state.append(v.state)
-            self.x_pos.append(v.cell.pos[0])
-            self.y_pos.append(v.cell.pos[1])
+        self.state = state
+        self.cell = cell
+        self.pos = pos
+        self.x_pos, self.y_pos = pos
+        self.SIZE = SIZE
+        self.work = work if work is not None else self.work_arrays(len(state))
+
+    @staticmethod
+    def work_arrays(n_vehicles):
+        return (np.empty((2, n_vehicles), dtype="int32"), np.empty((2, n_vehicles), dtype="int32"),
+                np.empty(n_vehicles, dtype=bool), np.empty(n_vehicles, dtype=bool))
 
     def mean_velocities(self, previous, delta_tsteps):
         """Given a previous snapshot, computes the mean speed of
         the vehicles moving (mean_speed) and the mean speed of all
         vehicles (mean_mobility). """
 
-        total_distance = 0
-        moving_vehicles = 0
+        # The operations write into the work arrays, allocating temporary
+        # arrays costs more than the operations for large fleets.
+        delta, wrapped, moving, equal = self.work
 
-        for i in range(len(self.x_pos)):
-            curr_st, prev_st = self.state[i], previous.state[i]
-            total_distance +=  lattice_distance(self.x_pos[i],
-                                               self.y_pos[i],
-                                               previous.x_pos[i],
-                                               previous.y_pos[i])
-            
-            
+        # Lattice distance between the positions in both snapshots.
+        np.subtract(self.pos, previous.pos, out=delta)
+        np.abs(delta, out=delta)
+        np.subtract(self.SIZE, delta, out=wrapped)
+        np.minimum(delta, wrapped, out=delta)
+        total_distance = int(delta.sum())
 
-            if curr_st in States.moving_states() or prev_st in States.moving_states():
-                moving_vehicles += 1
+        moving[:] = False
+        for value in MOVING_STATES:
+            moving |= np.equal(self.state, value, out=equal)
+            moving |= np.equal(previous.state, value, out=equal)
+        moving_vehicles = np.count_nonzero(moving)
 
         if moving_vehicles == 0:
             return 0, total_distance/(delta_tsteps*len(self.x_pos))
         else:
             return total_distance/(delta_tsteps*moving_vehicles), total_distance/(delta_tsteps*len(self.x_pos))
 
+    def moving_cells(self):
+        """Returns the array of the cell ids of the moving vehicles."""
+        moving = self.state == MOVING_STATES[0]
+        for value in MOVING_STATES[1:]:
+            moving |= self.state == value
+        return self.cell[moving]
+
+
+class SnapshotRing(object):
+
+    def __init__(self, n_vehicles, positions, SIZE, n_slots=2):
+        """Ring of preallocated snapshots. Taking a snapshot overwrites the
+        oldest one, so the last n_slots snapshots stay valid.
+
+        :param n_vehicles: number of vehicles of the simulation.
+        :param positions: array with the position of each cell, indexed by id.
+        :param SIZE: side of the city.
+        """
+        super().__init__()
+        self.x_column = np.ascontiguousarray(positions[:, 0], dtype="int32")
+        self.y_column = np.ascontiguousarray(positions[:, 1], dtype="int32")
+
+        self.state = np.zeros((n_slots, n_vehicles), dtype="uint8")
+        self.cell = np.zeros((n_slots, n_vehicles), dtype="int32")
+        self.pos = np.zeros((n_slots, 2, n_vehicles), dtype="int32")
+        work = SimulationSnapshot.work_arrays(n_vehicles)
+        self.snapshots = [SimulationSnapshot(self.state[k], self.cell[k], self.pos[k], SIZE, work)
+                          for k in range(n_slots)]
+        self.current = -1
+
+    def take(self, engine):
+        """Fills the next slot with the state and the position of the vehicles
+        of the engine and returns its snapshot."""
+        k = (self.current + 1) % len(self.snapshots)
+        engine.fill_snapshot(self.state[k], self.cell[k])
+        np.take(self.x_column, self.cell[k], out=self.pos[k, 0])
+        np.take(self.y_column, self.cell[k], out=self.pos[k, 1])
+        self.current = k
+        return self.snapshots[k]
+
 
 class SimulationMetric(object):
-    def __init__(self, city_map, stations, num_heat_snapshots, total_tsteps, delta_tsteps, SIZE):
+    def __init__(self, city_map, stations, num_heat_snapshots, total_tsteps, delta_tsteps, SIZE,
+                 writer=None, block_size=1024):
+        """Collects the measures of a repetition.
+
+        :param writer: a StreamWriter. When it is given the measures are written
+        every block_size measures and removed from memory, and each heat map is
+        written when it is taken. Otherwise every measure is kept in memory
+        until write_results() is called.
+        """
         super().__init__()
         self.SIZE = SIZE
+        self.writer = writer
+        self.block_size = block_size
         # For each state count the number of EV's in that state
         self.states_evolution = {s: [] for s in States}
         # Compute metrics about the speed and mobility
@@ -55,12 +128,17 @@ class SimulationMetric(object):
         self.mean_mobility_evolution = []
         # Compute metrics about the occupation of stations
         self.occupation_history = {st.cell.pos: [] for st in stations}
-        # Compute metrics about the placement of vehicles
-        self.heat_map = {pos: 0 for pos in city_map}
+        # Compute metrics about the placement of vehicles. The heat map counts
+        # the moving vehicles seen in each cell, indexed by the id of the cell.
+        self.heat_map = np.zeros(len(city_map), dtype="int64")
+        # Position of each cell, to write the heat maps as matrices.
+        self.heat_map_pos = tuple(np.array(list(city_map.keys()), dtype="int64").reshape(-1, 2).T)
         self.heat_map_tsteps = [int(((i+1)*total_tsteps)/(num_heat_snapshots*delta_tsteps))*delta_tsteps
                                 for i in range(num_heat_snapshots)]
         self.delta_tsteps = delta_tsteps
         self.heat_map_evolution = []
+        # Number of heat maps already written
+        self.heat_maps_written = 0
 
         # Compute the global metrics
         self.mean_seeking = None
@@ -74,7 +152,8 @@ class SimulationMetric(object):
         """Method that updates the internal variables with the data
         from the tstep=0 """
         self.update_states(ev_vehicles)
-        self.update_heat_map(vehicles, 0)
+        moving = [s.value for s in States.moving_states()]
+        self.update_heat_map(np.array([v.cell.id for v in vehicles if v.state.value in moving], dtype="int32"), 0)
         self.update_occupation(stations)
         self.seeking_history = {v.id: [] for v in ev_vehicles}
         self.queueing_history = {v.id: [] for v in ev_vehicles}
@@ -83,10 +162,13 @@ class SimulationMetric(object):
         """Method that updates the internal variables with the
         data from a tstep different from the first one. """
         self.update_states(ev_vehicles)
-        self.update_heat_map(vehicles, tstep)
+        self.update_heat_map(current.moving_cells(), tstep)
         self.update_occupation(stations)
         self.update_speed_mobility(current, previous)
 
+        if self.writer is not None and len(self.mean_speed_evolution) >= self.block_size:
+            self.write_blocks()
+
     def update_states(self, ev_vehicles):
         """Given a set/list of ev_vehicles, computes how many vehicles
         are in each state, then appends that data to the evolution lists.
@@ -101,22 +183,26 @@ class SimulationMetric(object):
         for s in States:
             self.states_evolution[s].append(state_count[s])
 
-    def update_heat_map(self, vehicles, tstep):
-        """Given the list of vehicles and the current time step, 
-        if a vehicle is moving, then increase the counter of the cell
-        that it's occupying. """
+    def update_heat_map(self, moving_cells, tstep):
+        """Given the array of cell ids of the moving vehicles and the
+        current time step, increases the counter of the cells that
+        they are occupying. """
 
         # First update the global count of the placement of vehicles
-        for v in vehicles:
-            if v.state in States.moving_states():
-                self.heat_map[v.cell.pos] += 1
+        self.heat_map += np.bincount(moving_cells, minlength=len(self.heat_map))
 
         # Then, check if we have to make a snapshot of the heat map
         if tstep in self.heat_map_tsteps:
-            heat = np.zeros((self.SIZE, self.SIZE), dtype="int32")
-            for pos, value in self.heat_map.items():
-                heat[pos] = value
-            self.heat_map_evolution.append(heat)
+            self.heat_map_evolution.append(self.heat_map.copy())
+            if self.writer is not None:
+                self.write_heat_maps()
+                self.writer.flush()
+
+    def heat_map_matrix(self, heat_map):
+        """Returns the heat map indexed by cell id as a SIZE x SIZE matrix."""
+        heat = np.zeros((self.SIZE, self.SIZE), dtype="int32")
+        heat[self.heat_map_pos] = heat_map
+        return heat
 
     def update_speed_mobility(self, current, previous):
         """Given the current snapshot and the last snapshot, 
@@ -166,57 +252,49 @@ class SimulationMetric(object):
 
 
 
-    def write_results(self, file, base_directory, seeking_history, queueing_history):
-        """Given a openned and writable HDF5 file, and the 
-        base directory where we are going to write, takes the
-        data from the simulation and stores it in the file. """
+    def write_blocks(self):
+        """Appends the measures kept in memory to the series of the writer and
+        removes them from memory. """
 
         # Write states evolution data
-        directory = base_directory + "states/"
-        size = len(self.states_evolution[States.AT_DEST])
-
         for s in States:
-            dset = file.create_dataset(
-                directory+str(s), (size,), dtype="uint32")
-            dset.write_direct(np.array(self.states_evolution[s]))
+            self.writer.append("states/" + str(s), self.states_evolution[s], "uint32")
+            self.states_evolution[s] = []
 
         # Write mean speed and mobility
-        directory = base_directory + "velocities/"
-        size = len(self.mean_speed_evolution)
-
-        dset = file.create_dataset(
-            directory + "speed", (size,), dtype="float32")
-        dset.write_direct(np.array(self.mean_speed_evolution))
-
-        dset = file.create_dataset(
-            directory + "mobility", (size,), dtype="float32")
-        dset.write_direct(np.array(self.mean_mobility_evolution))
+        self.writer.append("velocities/speed", self.mean_speed_evolution, "float32")
+        self.writer.append("velocities/mobility", self.mean_mobility_evolution, "float32")
+        self.mean_speed_evolution = []
+        self.mean_mobility_evolution = []
 
-        # Write heat map data
-        directory = base_directory + "heat_map/"
-        size = self.heat_map_evolution[0].shape
+        # Write occupation data
+        for pos, station_occupation in self.occupation_history.items():
+            self.writer.append("occupation/" + str(pos), station_occupation, "uint32")
+            self.occupation_history[pos] = []
 
-        for (i, heat) in enumerate(self.heat_map_evolution):
-            dset = file.create_dataset(directory+str(i), size, dtype="uint32")
-            dset.write_direct(heat)
+        self.write_heat_maps()
+        self.writer.flush()
 
-        # Write occupation data
-        directory = base_directory + "occupation/"
+    def write_heat_maps(self):
+        """Writes the heat maps kept in memory and removes them from memory."""
+        for heat in self.heat_map_evolution:
+            self.writer.write("heat_map/" + str(self.heat_maps_written), self.heat_map_matrix(heat), "uint32")
+            self.heat_maps_written += 1
+        self.heat_map_evolution = []
 
-        for pos, station_occupation in self.occupation_history.items():
-            size = len(station_occupation)
-            dset = file.create_dataset(
-                directory + str(pos), (size,), dtype="uint32")
-            dset.write_direct(np.array(station_occupation))
+    def close(self, seeking_history, queueing_history):
+        """Writes the measures left in memory and the global metrics. """
+        self.write_blocks()
 
         # Write seeking and queueing
         self.compute_seeking_queueing(seeking_history, queueing_history)
-        directory = base_directory + "global/"
+        self.writer.write("global/seeking", [self.mean_seeking], "float32")
+        self.writer.write("global/queueing", [self.mean_queueing], "float32")
+        self.writer.flush()
 
-        dset = file.create_dataset(
-            directory + "seeking", (1,), dtype="float32")
-        dset.write_direct(np.array(self.mean_seeking))
-
-        dset = file.create_dataset(
-            directory + "queueing", (1,), dtype="float32")
-        dset.write_direct(np.array(self.mean_queueing))
+    def write_results(self, file, base_directory, seeking_history, queueing_history):
+        """Given a openned and writable HDF5 file, and the 
+        base directory where we are going to write, takes the
+        data from the simulation and stores it in the file. """
+        self.writer = StreamWriter(file, base_directory)
+        self.close(seeking_history, queueing_history)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+
+
+class StreamWriter(object):
+    def __init__(self, file, base_directory, chunk_size=1024):
+        """Writes the results of a repetition in an HDF5 file while they are
+        produced. The series are resizable and chunked datasets that grow as
+        blocks of values are appended.
+
+        :param file: open and writable h5py File.
+        :param base_directory: group of the repetition, like "/0/".
+        :param chunk_size: number of values of each chunk of the series.
+        """
+        super().__init__()
+        self.file = file
+        self.base_directory = base_directory
+        self.chunk_size = chunk_size
+
+    def append(self, name, values, dtype):
+        """Appends the values at the end of the series name, which is created
+        the first time."""
+        name = self.base_directory + name
+        if name in self.file:
+            dset = self.file[name]
+        else:
+            dset = self.file.create_dataset(name, (0,), maxshape=(None,), chunks=(self.chunk_size,), dtype=dtype)
+        if len(values):
+            start = dset.shape[0]
+            dset.resize((start + len(values),))
+            dset[start:] = values
+
+    def write(self, name, data, dtype):
+        """Writes the array data in a new dataset."""
+        self.file.create_dataset(self.base_directory + name, data=data, dtype=dtype)
+
+    def flush(self):
+        """Writes the buffers of the file to disk, so the data written so far
+        can be read if the simulation is interrupted."""
+        self.file.flush()
+
+
+class BackgroundWriter(object):
+    def __init__(self, max_pending=64):
+        """Runs the methods of the writers in a thread, so the simulation goes
+        on while the results are written. The calls wait in a queue of at most
+        max_pending calls, the simulation waits when the queue is full.
+
+        The first error raised by a call is raised again, once, by the next call
+        to put() or close(), and the calls left are discarded.
+        """
+        super().__init__()
+        self.queue = queue.Queue(max_pending)
+        self.error = None
+        self.error_raised = False
+        self.thread = threading.Thread(target=self.run, name="BackgroundWriter", daemon=True)
+        self.thread.start()
+
+    def wrap(self, writer):
+        """Returns an object with the methods of the StreamWriter whose calls
+        are run in the thread."""
+        return QueuedWriter(self, writer)
+
+    def put(self, function, *args):
+        """Queues the call function(*args)."""
+        self.raise_error()
+        self.queue.put((function, args))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is None:
+                function, args = item
+                try:
+                    function(*args)
+                except BaseException as error:
+                    self.error = error
+
+    def close(self, raise_errors=True):
+        """Waits until every call is done and stops the thread. With raise_errors
+        False the error of a call is not raised, which is used when the caller
+        is already handling an error of its own."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if raise_errors:
+            self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None and not self.error_raised:
+            self.error_raised = True
+            raise RuntimeError("Error writing the results") from self.error
+
+
+class QueuedWriter(object):
+    def __init__(self, background, writer):
+        """StreamWriter whose calls are run by a BackgroundWriter. The values
+        given to the writer must not be modified afterwards."""
+        super().__init__()
+        self.background = background
+        self.writer = writer
+
+    def append(self, name, values, dtype):
+        self.background.put(self.writer.append, name, values, dtype)
+
+    def write(self, name, data, dtype):
+        self.background.put(self.writer.write, name, data, dtype)
+
+    def flush(self):
+        self.background.put(self.writer.flush)
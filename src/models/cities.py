@@ -2,9 +2,17 @@ from enum import Enum
 import random
 import numpy as np
 
-from src.simulator.cythonGraphFunctions import (configure_lattice_size,lattice_distance)
+from src.models.graph import CityGraph
+from src.simulator.cythonGraphFunctions import (configure_lattice_size,lattice_distance,nearest_targets)
 
 
+def torus_distances(positions, references, size):
+    """Returns the matrix of lattice distances, in a torus of side size, between
+    each pair of rows of the arrays positions (n, 2) and references (m, 2)."""
+    delta = np.abs(positions[:, None, :] - references[None, :, :])
+    delta = np.where(delta > size/2, size - delta, delta)
+    return delta.sum(axis=2)
+
 
 class CellType(Enum):
     HOUSE = 0
@@ -29,7 +37,7 @@ class Cell():
         self.r = []
         self.cell_type = cell_type.value
         self.direction = direction
-        self.occupied = False
+        self.id = None # Integer id of the cell in the graph of the city
         
     def duplicate_cell(self, dx, dy, total_size):
         """Given a displacement (dx, dy) creates a copy of this cell but shifted the amount passed
@@ -503,9 +511,12 @@ class SquareCity(CityBuilder):
 
  
         # Scale the city to the desired size
-        self.city_map, self.city_matrix = self.scale_city(SCALE)
+        self.set_city(*self.scale_city(SCALE))
+
+    def set_city(self, city_map, city_matrix, graph):
+        """Sets the cells of the city and the attributes computed from them."""
+        self.city_map, self.city_matrix, self.graph = city_map, city_matrix, graph
 
- 
         # Configure the global parameters of the simulator module
         configure_lattice_size(self.SIZE, self.city_map)
 
@@ -515,49 +526,131 @@ class SquareCity(CityBuilder):
         # Compute the street rate
         self.STR_RATE = np.sum(self.city_matrix)/(self.SIZE*self.SIZE)
 
-    def scale_city(self, scale):
-
-        def change_pos_to_references(cell, attribute, dictionary):
-            """Given a cell, and a list of keys (attribute), replace the 
-            keys for a reference to the object in the dictionary """
+    def to_arrays(self):
+        """Returns a dictionary of arrays that describes the city, the city can
+        be created again with SquareCity.from_arrays(). """
+        graph = self.graph
+        cells = list(self.city_map.values())
+        arrays = {"SIZE": np.array(self.SIZE), "base_size": np.array(self.base_size), "scale": np.array(self.scale),
+                  "positions": graph.positions, "cell_type": graph.cell_type, "offsets": graph.offsets,
+                  "neighbours": graph.neighbours, "priority": graph.priority,
+                  "direction": np.array([c.direction for c in cells], dtype="int8")}
+
+        # The predecessors given explicitly are the first of each list, the rest
+        # follow from the successors of the graph.
+        from_graph = {"predecessors": np.bincount(graph.neighbours, minlength=graph.n_cells),
+                      "prio_predecessors": np.bincount(graph.neighbours, weights=graph.priority, minlength=graph.n_cells)}
+        for attribute, counts in from_graph.items():
+            given = [(c.id, p.id) for c, n in zip(cells, counts.astype(int).tolist())
+                     for p in getattr(c, attribute)[:len(getattr(c, attribute)) - n]]
+            arrays[attribute] = np.array(given, dtype="int32").reshape(-1, 2)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Creates the city described by the arrays returned by SquareCity.to_arrays()
+        without building the base city."""
+        city = cls.__new__(cls)
+        CityBuilder.__init__(city)
+        city.SIZE, city.base_size, city.scale = int(arrays["SIZE"]), int(arrays["base_size"]), int(arrays["scale"])
+
+        graph = CityGraph(arrays["positions"], arrays["cell_type"], arrays["offsets"], arrays["neighbours"],
+                          arrays["priority"], city.SIZE)
+        city_matrix = np.zeros((city.SIZE, city.SIZE))
+        city_matrix[graph.positions[:, 0], graph.positions[:, 1]] = 1
+        predecessors, prio_predecessors = arrays["predecessors"], arrays["prio_predecessors"]
+        city_map = city.create_cells(graph, arrays["direction"].tolist(), (predecessors[:, 0], predecessors[:, 1]),
+                                     (prio_predecessors[:, 0], prio_predecessors[:, 1]))
+        city.set_city(city_map, city_matrix, graph)
+        return city
 
-            cell.__dict__[attribute] = [city_map[k] for k in cell.__dict__[attribute]]
-        
-        def add_predecessors(cell, attribute, successors_of_cell):
-            """Given a cell, an attibute we want to fullfill ("prio_predecessors" or "predecessors"), 
-            and the list of sucessors of the cell, fulffill the atttribute accordingly."""
-            for successor in successors_of_cell:
-                successor.__dict__[attribute].append(cell)
-        
-        # Augment the city by the scale
-        city_map = {}
+    def scale_city(self, scale):
+        """Creates the city tiling the base city scale x scale times. Returns a
+        tuple (city_map, city_matrix, graph). The city_map is sorted by position and
+        the id of each cell is its index in the city_map. The results of a seed
+        depend on this order, the vehicles are placed and their destinations are
+        chosen over the cells of the city_map.
+
+        The tiling is computed over arrays: the positions and the successors of
+        the base city are moved to each tile modulo SIZE, and the Cell objects
+        are created at the end from the graph of the city. """
+        base_cells = list(self.base_city.values())
+        n_base = len(base_cells)
+        tiles = np.array([(i*self.base_size, j*self.base_size) for i in range(scale) for j in range(scale)],
+                         dtype="int64").reshape(-1, 1, 2)
+
+        # Position of each cell, the cells of the tile t are t*n_base ... (t+1)*n_base - 1
+        base_positions = np.array([c.pos for c in base_cells], dtype="int64")
+        positions = ((base_positions + tiles) % self.SIZE).reshape(-1, 2)
         city_matrix = np.zeros((self.SIZE, self.SIZE))
-
-
-        for i in range(scale):
-            for j in range(scale):
-                dx, dy = i*self.base_size, j*self.base_size
-                for pos, cell in self.base_city.items():
-                    new_pos, new_cell = cell.duplicate_cell(dx, dy, self.SIZE)
-                    city_map[new_pos] = new_cell
-                    city_matrix[new_pos] = 1
-
-
-        # Replace the positions by the corresponding pointer to cells.
-        for pos, cell in city_map.items():
-            change_pos_to_references(cell, "prio_predecessors", city_map)
-            change_pos_to_references(cell, "predecessors", city_map)
-            change_pos_to_references(cell, "successors", city_map)
-            change_pos_to_references(cell, "prio_successors", city_map)
-        
-        # Complete the 'graph' of the city adding the predecessors and successors.
-        for pos, cell in city_map.items():   
-            
-            add_predecessors(cell, "predecessors", cell.successors)
-            add_predecessors(cell, "prio_predecessors", cell.prio_successors)
-
- 
-        return city_map, city_matrix
+        city_matrix[positions[:, 0], positions[:, 1]] = 1
+
+        # The id of each cell is its rank when the cells are sorted by position.
+        order = np.argsort(positions[:, 0] * self.SIZE + positions[:, 1], kind="stable")
+        ids = np.empty(len(order), dtype="int32")
+        ids[order] = np.arange(len(order), dtype="int32")
+        id_matrix = np.full((self.SIZE, self.SIZE), -1, dtype="int32")
+        id_matrix[positions[:, 0], positions[:, 1]] = ids
+
+        def tile_edges(attribute):
+            """Returns the ids (sources, targets) of the edges from each cell to
+            the positions in the attribute, in every tile."""
+            base_sources = np.array([k for (k, c) in enumerate(base_cells) for _ in getattr(c, attribute)], dtype="int64")
+            base_targets = np.array([p for c in base_cells for p in getattr(c, attribute)], dtype="int64").reshape(-1, 2)
+            sources = ids.reshape(-1, n_base)[:, base_sources]
+            targets = (base_targets + tiles) % self.SIZE
+            return sources.ravel(), id_matrix[targets[..., 0], targets[..., 1]].ravel()
+
+        # Successors in CSR format, the order of the successors of each cell is kept.
+        sources, targets = tile_edges("successors")
+        edge_order = np.argsort(sources, kind="stable")
+        offsets = np.zeros(len(order) + 1, dtype="int32")
+        np.cumsum(np.bincount(sources, minlength=len(order)), out=offsets[1:])
+        size = self.SIZE
+        prio_mask = [[(p[0] % size, p[1] % size) in {(q[0] % size, q[1] % size) for q in c.prio_successors}
+                      for p in c.successors] for c in base_cells]
+        priority = np.tile(np.array([m for mask in prio_mask for m in mask], dtype="uint8"), scale*scale)
+
+        cell_type = np.tile(np.array([c.cell_type for c in base_cells], dtype="uint8"), scale*scale)
+        graph = CityGraph(positions[order].astype("int32"), cell_type[order], offsets,
+                          targets[edge_order].astype("int32"), priority[edge_order], self.SIZE)
+
+        directions = np.tile(np.array([c.direction for c in base_cells]), scale*scale)[order].tolist()
+        city_map = self.create_cells(graph, directions, tile_edges("predecessors"), tile_edges("prio_predecessors"))
+        return city_map, city_matrix, graph
+
+    def create_cells(self, graph, directions, predecessors, prio_predecessors):
+        """Creates the Cell objects of the graph, sorted by id. Returns the city_map.
+
+        :param directions: list with the direction of each cell.
+        :param predecessors: tuple (sources, targets) of the ids of the predecessors
+        given explicitly, before the ones that follow from the successors.
+        :param prio_predecessors: the same for the priority predecessors.
+        """
+        cell_types = {t.value: t for t in CellType}
+        cells = [Cell(pos, cell_types[t], [], [], d)
+                 for (pos, t, d) in zip(map(tuple, graph.positions.tolist()), graph.cell_type.tolist(), directions)]
+
+        for attribute, (sources, targets) in (("predecessors", predecessors), ("prio_predecessors", prio_predecessors)):
+            for i, j in zip(sources.tolist(), targets.tolist()):
+                getattr(cells[i], attribute).append(cells[j])
+
+        neighbours, priority = graph.neighbours.tolist(), graph.priority.tolist()
+        offsets = graph.offsets.tolist()
+        rev_neighbours, rev_priority = graph.rev_neighbours.tolist(), graph.rev_priority.tolist()
+        rev_offsets = graph.rev_offsets.tolist()
+        for i, cell in enumerate(cells):
+            cell.id = i
+            for k in range(offsets[i], offsets[i+1]):
+                cell.successors.append(cells[neighbours[k]])
+                if priority[k]:
+                    cell.prio_successors.append(cells[neighbours[k]])
+            for k in range(rev_offsets[i], rev_offsets[i+1]):
+                cell.predecessors.append(cells[rev_neighbours[k]])
+                if rev_priority[k]:
+                    cell.prio_predecessors.append(cells[rev_neighbours[k]])
+
+        return {cell.pos: cell for cell in cells}
         
     def compute_street_length(self, x, y, direction):
         length = 0
@@ -569,18 +662,12 @@ class SquareCity(CityBuilder):
 
     def split_by_type(self):
         """Returns three sets, 1 avenues, 2 streets, 3 roundabouts"""
+        cells = list(self.city_map.values())
 
-        avenues, roundabouts, streets = set(), set(), set()
-
-        for pos, cell in self.city_map.items():
-            if cell.cell_type == CellType.STREET:
-                streets.add(cell)
-            elif cell.cell_type == CellType.AVENUE:
-                avenues.add(cell)
-            elif cell.cell_type == CellType.ROUNDABOUT:
-                roundabouts.add(cell)
+        def cells_of_type(cell_type):
+            return {cells[i] for i in np.flatnonzero(self.graph.cell_type == cell_type.value).tolist()}
 
-        return (avenues, streets, roundabouts)
+        return (cells_of_type(CellType.AVENUE), cells_of_type(CellType.STREET), cells_of_type(CellType.ROUNDABOUT))
 
     def set_max_chargers_stations(self,min_chargers, min_d_stations):
             """Given the minimum number of chargers and minimum number of total distributed stations, 
@@ -681,7 +768,7 @@ class SquareCity(CityBuilder):
 
         return stations_per_district
 
-    def place_stations_new(self, layout, total_d_st):
+    def place_stations_new(self, layout, total_d_st, influence="lattice"):
         """
         Computes the placement of new stations as well as the area of influence of each station. This means
         the area that serves each group of stations.
@@ -689,6 +776,9 @@ class SquareCity(CityBuilder):
         Args:
             layout (str): can have value 'central', 'distributed' or 'four'.
             total_d_st (int): total number of distributed stations.
+            influence (str): 'lattice' gives each position to the cluster with the nearest centre in the
+            lattice, 'network' to the cluster of the station with the shortest path from the position in
+            the road graph, which follows the direction of the streets.
 
         Returns:
             stations_cluster (list of list): is a list of list of tuples. Each list contains the 
@@ -700,27 +790,28 @@ class SquareCity(CityBuilder):
         """
 
         def nearest_cell_type(reference, type_set):
-            """Returns the nearest cell to reference that belongs to the type_set. """
-            nearest = reference
-            type_set_pos = [c.pos for c in type_set]
-            if reference not in type_set_pos:
-                candidates = [(i, j) for (i, j) in type_set_pos if i == reference[0] or j == reference[1]]
-                if len(candidates)==0:
-                    return nearest_cell_type((reference[0]+1, reference[1]+1), type_set)
-                nearest = min(candidates, key=lambda p: lattice_distance(*p, *reference))
-
-            return nearest
+            """Returns the nearest cell to reference among the positions of the array
+            type_set, the first one if there is a tie. Only the positions in the same
+            row or column are considered. """
+            x, y = reference
+            while True:
+                candidates = type_set[(type_set[:, 0] == x) | (type_set[:, 1] == y)]
+                if len(candidates):
+                    break
+                x, y = x + 1, y + 1
+            distances = torus_distances(candidates, np.array([(x, y)]), self.SIZE)[:, 0]
+            return tuple(candidates[np.argmin(distances)].tolist())
 
         def group_in_clusters(centres, positions):
             """Given a list of centres and a list of positions to sort, returns the clustering of the positions 
-            and the new centres. """
-            
-            centres = list(enumerate(centres))
+            and the new centres. Each position goes to the nearest centre, the first one if there is a tie."""
+            positions = list(positions)
+            array, centres_array = np.array(positions).reshape(-1, 2), np.array(centres).reshape(-1, 2)
+            # The distances are computed by blocks of positions to bound the memory used.
+            nearest = np.concatenate([np.argmin(torus_distances(array[k:k+4096], centres_array, self.SIZE), axis=1)
+                                      for k in range(0, len(array), 4096)] or [np.empty(0, dtype="int64")])
             clusters = [[] for _ in range(len(centres))]
-            
-            
-            for pos in positions:
-                (i, _) = min(centres, key=lambda c: lattice_distance(*(c[1]), *pos))
+            for pos, i in zip(positions, nearest.tolist()):
                 clusters[i].append(pos)
             new_centres = [ tuple(np.mean( np.array(c), axis=0, dtype="int32").tolist()) for c in clusters ]
             return new_centres, clusters
@@ -731,17 +822,19 @@ class SquareCity(CityBuilder):
 
         # Create the positions where the stations are going to be placed
         if layout == "central":
-            type_set = sorted(self.avenues)
+            type_set = self.avenues
             n_stations = 1
             n_clusters = 1  
         elif layout == "four":
-            type_set = sorted(self.avenues)
+            type_set = self.avenues
             n_stations = 4
             n_clusters = 4
         else:
-            type_set = sorted(self.streets)
+            type_set = self.streets
             n_stations = total_d_st
             n_clusters = total_d_st//4#int(self.scale * self.scale)
+        # Positions of the cells of the type, sorted.
+        type_set = np.array(sorted(c.pos for c in type_set), dtype="int64")
         stations_pos = []
         offset = int(self.SIZE/(n_stations**0.5))
         
@@ -781,7 +874,26 @@ class SquareCity(CityBuilder):
         #    i, _ = min(stations, key=lambda s: lattice_distance(*pos, *s[1]))
         #    pos_clusters[i].append(pos)
         
-        _, pos_clusters = group_in_clusters(stations_centres, self.city_map.keys())
-        
-        return stations_clusters, pos_clusters    
+        if influence == "lattice":
+            _, pos_clusters = group_in_clusters(stations_centres, self.city_map.keys())
+        elif influence == "network":
+            pos_clusters = self.network_influence_areas(stations_clusters)
+        else:
+            raise ValueError("Unknown influence area: {}".format(influence))
+        
+        return stations_clusters, pos_clusters
+
+    def network_influence_areas(self, stations_clusters):
+        """Returns the positions served by each cluster of stations: the positions
+        whose nearest station in the road graph belongs to the cluster. The
+        distances to every station are computed with a single search. """
+        stations = [pos for cluster in stations_clusters for pos in cluster]
+        cluster_of_station = np.repeat(np.arange(len(stations_clusters)), [len(c) for c in stations_clusters])
+        targets = self.graph.id_matrix[tuple(np.array(stations).reshape(-1, 2).T)]
+        nearest = nearest_targets(self.graph, targets)[2]
+
+        positions = list(self.city_map.keys())
+        cluster_of_cell = np.where(nearest >= 0, cluster_of_station[nearest], -1)
+        return [[positions[i] for i in np.flatnonzero(cluster_of_cell == k).tolist()]
+                for k in range(len(stations_clusters))]    
         
\ No newline at end of file
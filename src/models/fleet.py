@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .states import States
+
+
+class Fleet(object):
+    def __init__(self, vehicles, ev_vehicles):
+        """Structure of arrays with the state of every vehicle of a simulation.
+        The vehicle with index i in the list of vehicles is stored at the
+        position i of each array.
+
+        :param vehicles: list of Vehicle objects.
+        :param ev_vehicles: set of the vehicles that are electric.
+        """
+        self.size = len(vehicles)
+        self.electric = np.array([v in ev_vehicles for v in vehicles], dtype=bool)
+
+        # Attributes to restart the fleet
+        self.initial_cell = np.array([v.initial_cell.id for v in vehicles], dtype="int32")
+        self.initial_wait_time = np.array([v.initial_wait_time for v in vehicles], dtype="int32")
+        self.initial_battery = np.array([v.initial_battery if e else 0 for (v, e) in zip(vehicles, self.electric)],
+                                        dtype="int32")
+
+        self.state = np.empty(self.size, dtype="uint8")  # Value of the States of each vehicle
+        self.cell = np.empty(self.size, dtype="int32")  # Id of the current cell
+        self.destination = np.empty(self.size, dtype="int32")  # Id of the destination cell
+        self.wait_time = np.empty(self.size, dtype="int32")  # Time left idle
+        self.battery = np.empty(self.size, dtype="int32")  # Battery left, zero for non electric vehicles
+        self.station = np.empty(self.size, dtype="int32")  # Index of the station, -1 if there is none.
+        self.seeking = np.empty(self.size, dtype="int32")  # Last time spent seeking
+        self.queueing = np.empty(self.size, dtype="int32")  # Last time spent queueing
+        self.recompute_path = np.empty(self.size, dtype=bool)
+
+        self.restart()
+
+    def restart(self):
+        """Sets every vehicle to its original place with all the attributes as
+        the start of the simulation."""
+        self.state[:] = States.AT_DEST.value
+        self.cell[:] = self.initial_cell
+        self.destination[:] = self.initial_cell
+        self.wait_time[:] = self.initial_wait_time
+        self.battery[:] = self.initial_battery
+        self.station[:] = -1
+        self.seeking[:] = 0
+        self.queueing[:] = 0
+        self.recompute_path[:] = False
+
+    def count_states(self, electric_only=True):
+        """Returns an array with the number of vehicles in each state, indexed
+        by the value of the state."""
+        states = self.state[self.electric] if electric_only else self.state
+        return np.bincount(states, minlength=len(States))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class CityGraph(object):
+    def __init__(self, positions, cell_type, offsets, neighbours, priority, SIZE):
+        """Compact representation of the road graph of a city. Each cell is
+        identified by an integer id and the successors of the cell i are stored
+        in CSR format: neighbours[offsets[i]:offsets[i+1]].
+
+        :param positions: int32 array of shape (n, 2) with the position of each cell.
+        :param cell_type: uint8 array with the CellType value of each cell.
+        :param offsets: int32 array of length n+1.
+        :param neighbours: int32 array with the id of the successors of each cell.
+        :param priority: uint8 array, 1 if the edge with the same index in
+        neighbours is a priority successor.
+        :param SIZE: size of the side of the city.
+        """
+        super().__init__()
+        self.SIZE = SIZE
+        self.n_cells = len(cell_type)
+        self.positions = positions
+        self.cell_type = cell_type
+        self.offsets = offsets
+        self.neighbours = neighbours
+        self.priority = priority
+
+        # Cost of each edge, the same used by the A* algorithm: the type of
+        # the road plus one if the vehicle has to give way.
+        self.cost = np.repeat(cell_type.astype("int32"), np.diff(offsets)) + 1 - priority
+
+        # Matrix with the id of the cell at each position, -1 if there is no road.
+        self.id_matrix = np.full((SIZE, SIZE), -1, dtype="int32")
+        self.id_matrix[positions[:, 0], positions[:, 1]] = np.arange(self.n_cells, dtype="int32")
+
+        # Reverse adjacency, the predecessors of i are rev_neighbours[rev_offsets[i]:rev_offsets[i+1]]
+        self.rev_offsets, self.rev_neighbours, self.rev_priority, self.rev_cost = self.reverse()
+
+    @classmethod
+    def from_cells(cls, cells, SIZE):
+        """Given a list of Cell objects where the index of each cell is its id,
+        creates the graph of the city. """
+        positions = np.array([c.pos for c in cells], dtype="int32").reshape(-1, 2)
+        cell_type = np.array([c.cell_type for c in cells], dtype="uint8")
+        degree = np.array([len(c.successors) for c in cells], dtype="int32")
+        offsets = np.zeros(len(cells) + 1, dtype="int32")
+        np.cumsum(degree, out=offsets[1:])
+
+        neighbours = np.array([s.id for c in cells for s in c.successors], dtype="int32")
+        priority = np.array([s in c.prio_successors for c in cells for s in c.successors], dtype="uint8")
+
+        return cls(positions, cell_type, offsets, neighbours, priority, SIZE)
+
+    def sources(self):
+        """Returns the id of the cell where each edge starts."""
+        return np.repeat(np.arange(self.n_cells, dtype="int32"), np.diff(self.offsets))
+
+    def reverse(self):
+        """Computes the reverse adjacency of the graph in CSR format. Returns a
+        tuple (offsets, neighbours, priority, cost) """
+        order = np.argsort(self.neighbours, kind="stable")
+        rev_offsets = np.zeros(self.n_cells + 1, dtype="int32")
+        np.cumsum(np.bincount(self.neighbours, minlength=self.n_cells), out=rev_offsets[1:])
+
+        return rev_offsets, self.sources()[order], self.priority[order], self.cost[order]
+
+    def successors(self, i):
+        """Returns the ids of the successors of the cell i."""
+        return self.neighbours[self.offsets[i]:self.offsets[i+1]]
+
+    def predecessors(self, i):
+        """Returns the ids of the predecessors of the cell i."""
+        return self.rev_neighbours[self.rev_offsets[i]:self.rev_offsets[i+1]]
+
+    def nbytes(self):
+        """Returns the memory used by the arrays of the graph."""
+        return sum(v.nbytes for v in self.__dict__.values() if isinstance(v, np.ndarray))
@@ -8,6 +8,7 @@ class Station(object):
         self.N_CHARGERS = N_CHARGERS # Total number of plugs
         self.available = None # Number of available chargers 
         self.queue = None # Current queue of vehicles.
+        self.queue_tsteps = None # Time step when each vehicle of the queue arrived.
         
         self.restart()
 
@@ -22,6 +23,17 @@ class Station(object):
             r = True
         return r
 
+    def enqueue(self, vehicle, tstep):
+        """Adds the vehicle to the end of the queue at the time step tstep. """
+        self.queue.append(vehicle)
+        self.queue_tsteps.append(tstep)
+
+    def dequeue(self, tstep):
+        """Removes the first vehicle of the queue at the time step tstep. Returns
+        the vehicle and the number of steps it has been queueing, both the
+        arrival and the current steps included. """
+        return self.queue.popleft(), tstep - self.queue_tsteps.popleft() + 1
+
     def vehicle_leaving(self):
         """Sets free the charger that was previously occuppied. """
         self.available += 1
@@ -30,3 +42,4 @@ class Station(object):
     def restart(self):
         self.available = self.N_CHARGERS
         self.queue = deque()
+        self.queue_tsteps = deque()
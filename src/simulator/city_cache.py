@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+
+from src.simulator.routing import make_directory
+
+
+def save_arrays(arrays, filename):
+    """Stores the dictionary of arrays in a .npz file. The file is written to a
+    temporary file that is renamed at the end, so processes that build the same
+    file at the same time don't see a partial file."""
+    make_directory(filename)
+    temporary = "{}.{}.tmp".format(filename, os.getpid())
+    with open(temporary, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temporary, filename)
+
+
+def load_arrays(filename):
+    """Returns the dictionary of arrays stored in the .npz file."""
+    with np.load(filename) as f:
+        return {key: f[key] for key in f.files}
+
+
+def load_city(Builder, filename, *args):
+    """Returns the city stored in the file. When the file doesn't exist the city
+    is created with Builder(*args) and stored.
+
+    :param Builder: a CityBuilder class with the methods to_arrays() and from_arrays().
+    """
+    if os.path.exists(filename):
+        return Builder.from_arrays(load_arrays(filename))
+
+    city = Builder(*args)
+    save_arrays(city.to_arrays(), filename)
+    return city
+
+
+def load_stations_placement(city, layout, total_d_st, filename, influence="lattice"):
+    """Returns the tuple (stations_clusters, pos_clusters) computed by
+    city.place_stations_new(layout, total_d_st, influence), stored in the file.
+    When the file doesn't exist the placement is computed and stored."""
+    if os.path.exists(filename):
+        arrays = load_arrays(filename)
+        return (split_clusters(arrays["stations"], arrays["stations_lengths"]),
+                split_clusters(arrays["positions"], arrays["positions_lengths"]))
+
+    stations_clusters, pos_clusters = city.place_stations_new(layout, total_d_st, influence)
+    arrays = {}
+    for name, clusters in (("stations", stations_clusters), ("positions", pos_clusters)):
+        arrays[name] = np.array([pos for cluster in clusters for pos in cluster], dtype="int32").reshape(-1, 2)
+        arrays[name + "_lengths"] = np.array([len(cluster) for cluster in clusters], dtype="int64")
+    save_arrays(arrays, filename)
+    return stations_clusters, pos_clusters
+
+
+def split_clusters(positions, lengths):
+    """Returns the list of clusters of positions (tuples) stored as an array of
+    positions and the length of each cluster."""
+    positions = [tuple(pos) for pos in positions.tolist()]
+    ends = np.cumsum(lengths).tolist()
+    return [positions[end - length:end] for end, length in zip(ends, lengths.tolist())]
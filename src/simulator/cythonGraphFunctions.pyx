@@ -1,7 +1,13 @@
+# cython: legacy_implicit_noexcept=True
+cimport cython
 from libc.math cimport abs as cabs
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from heapq import heappop, heappush
 
+import numpy as np
+
 #GLOBAL ATTRIBUTES OF THIS CLASS
 
 cdef dict CITY
@@ -164,3 +170,1166 @@ cdef class AStar():
 
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef class GraphAStar(AStar):
+    """A* algorithm over the integer ids of the CityGraph. The scores of the
+    search are kept in arrays allocated once and invalidated by a generation
+    stamp, and the open set is a binary heap with decrease-key. Ties are broken
+    by cell id, which follows the position of the cells, so the paths are the
+    same that AStar computes over the Cell objects. """
+    cdef public list cells
+    cdef int n_cells, size
+    cdef int[:] offsets, neighbours, cost, pos_x, pos_y
+    # Scores of the search, valid when the stamp of the cell is the current generation.
+    cdef int[:] g_score, came_from, seen, closed
+    cdef int generation
+    # Binary heap of cell ids sorted by key.
+    cdef int[:] heap, heap_index
+    cdef long long[:] key
+    cdef int heap_size
+    # Cache of paths, stored as offsets from the start, keyed by the start
+    # position inside the tile of the city and the displacement to the goal.
+    cdef int[:, :] id_matrix
+    cdef object cache
+    cdef int period, cache_size
+    cdef public long cache_hits, cache_misses
+    # Distances to and from each landmark used by the ALT heuristic.
+    cdef public list landmarks
+    cdef int[:, :] to_landmark, from_landmark
+    cdef int n_landmarks
+    # Cells expanded by the last search and by every search.
+    cdef public long expansions, total_expansions
+    # Bidirectional search: reverse adjacency, scores of the backward search and
+    # heaps of both directions.
+    cdef public bint bidirectional
+    cdef int[:] rev_offsets, rev_neighbours, rev_cost
+    cdef int[:] backward_g_score, came_to, backward_seen, backward_closed
+    cdef long long[:] forward_heap, backward_heap
+    # Repair of a path after a diversion: cells of the path marked with the
+    # current generation and their index in the path.
+    cdef public int repair_horizon, repair_limit
+    cdef public long repairs, failed_repairs
+    cdef int[:] path_stamp, path_index
+    # Searches with their own arrays that compute the batches of paths in parallel.
+    cdef public list workers
+    cdef object executor
+
+    def __init__(self, max_length, graph, cells):
+        """
+        :param graph: a CityGraph.
+        :param cells: list of Cell objects where the index is the cell id.
+        """
+        super().__init__(max_length)
+        self.cells = cells
+        self.n_cells = graph.n_cells
+        self.size = graph.SIZE
+        self.offsets = np.ascontiguousarray(graph.offsets, dtype="int32")
+        self.neighbours = np.ascontiguousarray(graph.neighbours, dtype="int32")
+        self.cost = np.ascontiguousarray(graph.cost, dtype="int32")
+        self.pos_x = np.ascontiguousarray(graph.positions[:, 0], dtype="int32")
+        self.pos_y = np.ascontiguousarray(graph.positions[:, 1], dtype="int32")
+
+        self.g_score = np.zeros(self.n_cells, dtype="int32")
+        self.came_from = np.zeros(self.n_cells, dtype="int32")
+        self.seen = np.zeros(self.n_cells, dtype="int32")
+        self.closed = np.zeros(self.n_cells, dtype="int32")
+        self.heap = np.zeros(self.n_cells, dtype="int32")
+        self.heap_index = np.zeros(self.n_cells, dtype="int32")
+        self.key = np.zeros(self.n_cells, dtype="int64")
+        self.generation = 0
+        self.heap_size = 0
+
+        self.id_matrix = np.ascontiguousarray(graph.id_matrix, dtype="int32")
+        self.cache = OrderedDict()
+        self.period = 0
+        self.cache_size = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self.landmarks = []
+        self.n_landmarks = 0
+        self.expansions = 0
+        self.total_expansions = 0
+
+        self.bidirectional = False
+        self.rev_offsets = np.ascontiguousarray(graph.rev_offsets, dtype="int32")
+        self.rev_neighbours = np.ascontiguousarray(graph.rev_neighbours, dtype="int32")
+        self.rev_cost = np.ascontiguousarray(graph.rev_cost, dtype="int32")
+        self.backward_g_score = np.zeros(self.n_cells, dtype="int32")
+        self.came_to = np.zeros(self.n_cells, dtype="int32")
+        self.backward_seen = np.zeros(self.n_cells, dtype="int32")
+        self.backward_closed = np.zeros(self.n_cells, dtype="int32")
+        # Every edge pushes at most one entry in the heap of each direction
+        self.forward_heap = np.zeros(len(graph.neighbours) + 1, dtype="int64")
+        self.backward_heap = np.zeros(len(graph.neighbours) + 1, dtype="int64")
+
+        self.repair_horizon = 64
+        self.repair_limit = 256
+        self.repairs = 0
+        self.failed_repairs = 0
+        self.path_stamp = np.zeros(self.n_cells, dtype="int32")
+        self.path_index = np.zeros(self.n_cells, dtype="int32")
+
+        self.workers = []
+        self.executor = None
+
+    def set_landmarks(self, graph, landmarks):
+        """Enables the ALT heuristic: for each landmark L the cost of the path from
+        a cell to the goal is at least d(cell, L) - d(goal, L) and d(L, goal) -
+        d(L, cell), so the heuristic is the maximum of these bounds and the lattice
+        distance. The distances are computed once here.
+
+        :param landmarks: list of cell ids, see select_landmarks().
+        """
+        to_landmark = np.empty((len(landmarks), self.n_cells), dtype="int32")
+        from_landmark = np.empty((len(landmarks), self.n_cells), dtype="int32")
+        for k, landmark in enumerate(landmarks):
+            to_landmark[k] = reverse_dijkstra(graph, landmark)[0]
+            from_landmark[k] = dijkstra(graph, landmark)[0]
+        if (to_landmark < 0).any() or (from_landmark < 0).any():
+            raise ValueError("The landmarks can't reach every cell of the graph")
+
+        self.landmarks = list(landmarks)
+        self.to_landmark, self.from_landmark = to_landmark, from_landmark
+        self.n_landmarks = len(landmarks)
+        self.clear_cache()
+
+    def set_path_cache(self, int period, int cache_size):
+        """Enables a cache of paths for a city that is a periodic tiling of a tile
+        of side period: the path between two cells is the same, up to a translation,
+        for every pair of cells with the same displacement and the same position
+        inside the tile. At most cache_size paths are kept, the least recently
+        used is discarded first.
+
+        A translated path has the same cost as the one a new search would find,
+        although they can differ when there are ties. """
+        self.period = period
+        self.cache_size = cache_size
+        self.clear_cache()
+
+    def set_workers(self, graph, int n_workers):
+        """Spreads the searches of new_paths_ids() over a pool of n_workers
+        threads. Each thread searches with its own GraphAStar, and the searches
+        release the GIL, so they run in parallel. The workers use the landmarks
+        and the search mode of this object, the cache is only kept here.
+
+        :param n_workers: number of threads, with one or less the paths are
+        searched in the calling thread.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.workers = []
+        self.executor = None
+        if n_workers > 1:
+            self.workers = [GraphAStar(self.max_length, graph, self.cells) for _ in range(n_workers)]
+            self.executor = ThreadPoolExecutor(n_workers)
+
+    cdef void share_setup(self, GraphAStar worker):
+        "Makes the worker search like this object."
+        worker.bidirectional = self.bidirectional
+        worker.landmarks = self.landmarks
+        worker.n_landmarks = self.n_landmarks
+        if self.n_landmarks:
+            worker.to_landmark = self.to_landmark
+            worker.from_landmark = self.from_landmark
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    cdef tuple cache_key(self, int start, int goal):
+        return (self.pos_x[start] % self.period, self.pos_y[start] % self.period,
+                (self.pos_x[goal] - self.pos_x[start]) % self.size,
+                (self.pos_y[goal] - self.pos_y[start]) % self.size)
+
+    cdef void store_path(self, tuple key, list ids, int start):
+        "Stores the path as the offsets of each cell with respect to the start."
+        cdef int i, cell
+        cdef int[:] offsets = np.empty(2*len(ids), dtype="int32")
+        for i in range(len(ids)):
+            cell = ids[i]
+            offsets[2*i] = (self.pos_x[cell] - self.pos_x[start]) % self.size
+            offsets[2*i + 1] = (self.pos_y[cell] - self.pos_y[start]) % self.size
+        self.cache[key] = offsets
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    cdef list translate_path(self, int[:] offsets, int start):
+        "Returns the ids of the cached path moved to start at the cell start."
+        cdef int i
+        cdef list ids = []
+        for i in range(0, offsets.shape[0], 2):
+            ids.append(self.id_matrix[(self.pos_x[start] + offsets[i]) % self.size,
+                                      (self.pos_y[start] + offsets[i + 1]) % self.size])
+        return ids
+
+    cdef inline int heuristic(self, int cell, int goal) nogil:
+        "Lower bound of the cost from cell to goal: the lattice distance, improved by the landmarks if there are any."
+        cdef int dx = self.pos_x[cell] - self.pos_x[goal]
+        cdef int dy = self.pos_y[cell] - self.pos_y[goal]
+        cdef int h, bound, k
+        if dx < 0:
+            dx = -dx
+        if 2*dx > self.size:
+            dx = self.size - dx
+        if dy < 0:
+            dy = -dy
+        if 2*dy > self.size:
+            dy = self.size - dy
+        h = dx + dy
+
+        for k in range(self.n_landmarks):
+            bound = self.to_landmark[k, cell] - self.to_landmark[k, goal]
+            if bound > h:
+                h = bound
+            bound = self.from_landmark[k, goal] - self.from_landmark[k, cell]
+            if bound > h:
+                h = bound
+        return h
+
+    cdef inline int potential(self, int cell, int start, int goal) nogil:
+        """Potential of the bidirectional search, twice the average of the bounds
+        to the goal and from the start. The reduced costs of the edges are the
+        same in both directions, so the searches can stop as soon as the sum of
+        their lowest keys reaches the best path found. """
+        return self.heuristic(cell, goal) - self.heuristic(start, cell)
+
+    cdef void new_generation(self) nogil:
+        "Invalidates the scores of the previous search."
+        cdef int i
+        if self.generation == 2147483647:
+            for i in range(self.n_cells):
+                self.seen[i] = 0
+                self.closed[i] = 0
+                self.backward_seen[i] = 0
+                self.backward_closed[i] = 0
+                self.path_stamp[i] = 0
+            self.generation = 0
+        self.generation += 1
+        self.heap_size = 0
+
+    cdef void sift_up(self, int index) nogil:
+        cdef int cell = self.heap[index]
+        cdef int parent
+        while index > 0:
+            parent = (index - 1) >> 1
+            if self.key[self.heap[parent]] <= self.key[cell]:
+                break
+            self.heap[index] = self.heap[parent]
+            self.heap_index[self.heap[index]] = index
+            index = parent
+        self.heap[index] = cell
+        self.heap_index[cell] = index
+
+    cdef void sift_down(self, int index) nogil:
+        cdef int cell = self.heap[index]
+        cdef int child
+        while True:
+            child = 2*index + 1
+            if child >= self.heap_size:
+                break
+            if child + 1 < self.heap_size and self.key[self.heap[child + 1]] < self.key[self.heap[child]]:
+                child += 1
+            if self.key[cell] <= self.key[self.heap[child]]:
+                break
+            self.heap[index] = self.heap[child]
+            self.heap_index[self.heap[index]] = index
+            index = child
+        self.heap[index] = cell
+        self.heap_index[cell] = index
+
+    cdef void push(self, int cell, long long key) nogil:
+        "Inserts the cell in the heap or decreases its key if it is already there."
+        self.key[cell] = key
+        if self.seen[cell] == self.generation and self.heap_index[cell] >= 0:
+            self.sift_up(self.heap_index[cell])
+        else:
+            self.heap[self.heap_size] = cell
+            self.heap_size += 1
+            self.sift_up(self.heap_size - 1)
+
+    cdef int pop(self) nogil:
+        cdef int cell = self.heap[0]
+        self.heap_size -= 1
+        self.heap_index[cell] = -1
+        if self.heap_size > 0:
+            self.heap[0] = self.heap[self.heap_size]
+            self.sift_down(0)
+        return cell
+
+    cdef int search(self, int start, int goal) nogil:
+        """Runs the search from start to goal. Returns 1 if the goal has been
+        reached, the path is stored in came_from."""
+        cdef int current, successor, edge, new_g_score
+        cdef long long n = self.n_cells
+
+        self.new_generation()
+        self.expansions = 0
+        self.g_score[start] = 0
+        self.came_from[start] = start
+        self.push(start, self.heuristic(start, goal) * n + start)
+        self.seen[start] = self.generation
+
+        while self.heap_size > 0:
+            # Take the most promising cell (lowest f_score, then lowest id)
+            current = self.pop()
+            if current == goal:
+                return 1
+            self.closed[current] = self.generation
+            self.expansions += 1
+            self.total_expansions += 1
+
+            for edge in range(self.offsets[current], self.offsets[current + 1]):
+                successor = self.neighbours[edge]
+                if self.closed[successor] == self.generation:
+                    continue
+                new_g_score = self.g_score[current] + self.cost[edge]
+                if self.seen[successor] != self.generation or new_g_score < self.g_score[successor]:
+                    if self.seen[successor] != self.generation:
+                        self.heap_index[successor] = -1
+                    self.push(successor, (new_g_score + self.heuristic(successor, goal)) * n + successor)
+                    self.seen[successor] = self.generation
+                    self.g_score[successor] = new_g_score
+                    self.came_from[successor] = current
+        return 0
+
+    cdef int rejoin_search(self, int start, int anchor) nogil:
+        """Runs the search from start towards the anchor until it reaches a cell
+        marked in path_stamp or it has expanded repair_limit cells. Returns the
+        cell reached, -1 if there is none. The caller starts the generation and
+        marks the path."""
+        cdef int current, successor, edge, new_g_score
+        cdef long long n = self.n_cells
+
+        self.expansions = 0
+        self.g_score[start] = 0
+        self.came_from[start] = start
+        self.push(start, self.heuristic(start, anchor) * n + start)
+        self.seen[start] = self.generation
+
+        while self.heap_size > 0 and self.expansions < self.repair_limit:
+            current = self.pop()
+            if current != start and self.path_stamp[current] == self.generation:
+                return current
+            self.closed[current] = self.generation
+            self.expansions += 1
+            self.total_expansions += 1
+
+            for edge in range(self.offsets[current], self.offsets[current + 1]):
+                successor = self.neighbours[edge]
+                if self.closed[successor] == self.generation:
+                    continue
+                new_g_score = self.g_score[current] + self.cost[edge]
+                if self.seen[successor] != self.generation or new_g_score < self.g_score[successor]:
+                    if self.seen[successor] != self.generation:
+                        self.heap_index[successor] = -1
+                    self.push(successor, (new_g_score + self.heuristic(successor, anchor)) * n + successor)
+                    self.seen[successor] = self.generation
+                    self.g_score[successor] = new_g_score
+                    self.came_from[successor] = current
+        return -1
+
+    cdef int bidirectional_search(self, int start, int goal) nogil:
+        """Runs a forward search from start and a backward search from goal over
+        the reverse adjacency, each key is twice the distance plus the potential
+        of the cell (minus it for the backward search). Returns the cell where
+        the shortest path changes from the forward to the backward search, -1 if
+        the goal can't be reached. The path is stored in came_from and came_to."""
+        cdef long long n = self.n_cells, key
+        cdef int forward_size = 1, backward_size = 1, best = -1, meeting = -1
+        cdef int cell, edge, neighbour, d
+        cdef bint forward
+
+        self.new_generation()
+        self.expansions = 0
+        self.g_score[start] = 0
+        self.came_from[start] = start
+        self.seen[start] = self.generation
+        self.forward_heap[0] = self.potential(start, start, goal) * n + start
+        self.backward_g_score[goal] = 0
+        self.came_to[goal] = goal
+        self.backward_seen[goal] = self.generation
+        self.backward_heap[0] = -self.potential(goal, start, goal) * n + goal
+
+        while forward_size > 0 and backward_size > 0:
+            if best >= 0 and (self.forward_heap[0] // n) + (self.backward_heap[0] // n) >= 2 * best:
+                break
+            forward = self.forward_heap[0] // n <= self.backward_heap[0] // n
+
+            if forward:
+                key = heap_pop(self.forward_heap, forward_size)
+                forward_size -= 1
+                cell = key % n
+                if self.closed[cell] == self.generation:
+                    continue
+                self.closed[cell] = self.generation
+                self.expansions += 1
+                for edge in range(self.offsets[cell], self.offsets[cell + 1]):
+                    neighbour = self.neighbours[edge]
+                    d = self.g_score[cell] + self.cost[edge]
+                    if self.seen[neighbour] != self.generation or d < self.g_score[neighbour]:
+                        self.seen[neighbour] = self.generation
+                        self.g_score[neighbour] = d
+                        self.came_from[neighbour] = cell
+                        heap_push(self.forward_heap, forward_size, (2*d + self.potential(neighbour, start, goal)) * n + neighbour)
+                        forward_size += 1
+                        if self.backward_seen[neighbour] == self.generation and (best < 0 or d + self.backward_g_score[neighbour] < best):
+                            best, meeting = d + self.backward_g_score[neighbour], neighbour
+            else:
+                key = heap_pop(self.backward_heap, backward_size)
+                backward_size -= 1
+                cell = key % n
+                if self.backward_closed[cell] == self.generation:
+                    continue
+                self.backward_closed[cell] = self.generation
+                self.expansions += 1
+                for edge in range(self.rev_offsets[cell], self.rev_offsets[cell + 1]):
+                    neighbour = self.rev_neighbours[edge]
+                    d = self.backward_g_score[cell] + self.rev_cost[edge]
+                    if self.backward_seen[neighbour] != self.generation or d < self.backward_g_score[neighbour]:
+                        self.backward_seen[neighbour] = self.generation
+                        self.backward_g_score[neighbour] = d
+                        self.came_to[neighbour] = cell
+                        heap_push(self.backward_heap, backward_size, (2*d - self.potential(neighbour, start, goal)) * n + neighbour)
+                        backward_size += 1
+                        if self.seen[neighbour] == self.generation and (best < 0 or d + self.g_score[neighbour] < best):
+                            best, meeting = d + self.g_score[neighbour], neighbour
+
+        self.total_expansions += self.expansions
+        return meeting
+
+    cdef list reconstruct_ids(self, int start, int goal):
+        cdef list total = [goal]
+        cdef int current = goal
+        while True:
+            current = self.came_from[current]
+            if current == start:
+                break
+            total.append(current)
+        return total
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef Py_ssize_t write_path(self, int start, int goal, int meeting, int[:] ids, Py_ssize_t end) nogil:
+        """Writes the ids of the path found by the last search at ids[end:], in the
+        order of reconstruct_bidirectional_ids(), and returns the new end. The
+        meeting cell of a forward search is the goal."""
+        cdef int cell = meeting
+        cdef Py_ssize_t length = 0, i
+        # Cells after the meeting cell, found by the backward search.
+        while cell != goal:
+            cell = self.came_to[cell]
+            length += 1
+        cell, i = meeting, length
+        while cell != goal:
+            cell = self.came_to[cell]
+            i -= 1
+            ids[end + i] = cell
+        end += length
+        # The meeting cell and the cells before it, except the start.
+        cell = meeting
+        while cell != start:
+            ids[end] = cell
+            end += 1
+            cell = self.came_from[cell]
+        return end
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def search_paths(self, starts, goals):
+        """Searches the path between each pair of cells without the GIL and
+        without the cache. Returns the arrays (ids, ends, found): when found[k]
+        is True the path of the pair k is ids[ends[k]:ends[k+1]], with the cells
+        in the order of new_path_ids().
+
+        :param starts: array of the ids of the start cells.
+        :param goals: array of the ids of the goal cells.
+        """
+        cdef int[:] start_ids = np.ascontiguousarray(starts, dtype="int32")
+        cdef int[:] goal_ids = np.ascontiguousarray(goals, dtype="int32")
+        cdef Py_ssize_t n = start_ids.shape[0], k, end = 0
+        cdef long long[:] ends = np.zeros(n + 1, dtype="int64")
+        cdef unsigned char[:] found = np.zeros(n, dtype="uint8")
+        cdef int start, goal, meeting
+        buffer = np.empty(self.n_cells + 64*n, dtype="int32")
+        cdef int[:] ids = buffer
+
+        with nogil:
+            for k in range(n):
+                start, goal = start_ids[k], goal_ids[k]
+                if end + self.n_cells > ids.shape[0]:
+                    # A path has at most n_cells cells.
+                    with gil:
+                        buffer = np.concatenate((buffer, np.empty(buffer.shape[0], dtype="int32")))
+                        ids = buffer
+                if start == goal:
+                    ids[end] = goal
+                    end += 1
+                    found[k] = 1
+                else:
+                    if self.bidirectional:
+                        meeting = self.bidirectional_search(start, goal)
+                    elif self.search(start, goal):
+                        meeting = goal
+                    else:
+                        meeting = -1
+                    if meeting >= 0:
+                        end = self.write_path(start, goal, meeting, ids, end)
+                        found[k] = 1
+                ends[k + 1] = end
+
+        return buffer[:end], np.asarray(ends), np.asarray(found).astype(bool)
+
+    cdef list reconstruct_bidirectional_ids(self, int start, int goal, int meeting):
+        "Joins the paths of both directions at the meeting cell."
+        cdef list total = []
+        cdef int current = meeting
+        while current != goal:
+            current = self.came_to[current]
+            total.append(current)
+        total.reverse()
+        if meeting != start:
+            total.append(meeting)
+            total.extend(self.reconstruct_ids(start, meeting)[1:])
+        return total
+
+    cpdef list new_path_ids(self, int start, int goal):
+        """Returns the ids of the cells of the path from start to goal, in reverse
+        order and without the start, like AStar.new_path(). """
+        cdef tuple key
+        cdef list ids
+
+        if self.cache_size > 0:
+            key = self.cache_key(start, goal)
+            offsets = self.cache.get(key)
+            if offsets is not None:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+                self.expansions = 0
+                return self.translate_path(offsets, start)
+            self.cache_misses += 1
+
+        if start == goal:
+            ids = [goal]
+        elif self.bidirectional:
+            meeting = self.bidirectional_search(start, goal)
+            if meeting < 0:
+                return None
+            ids = self.reconstruct_bidirectional_ids(start, goal, meeting)
+        elif self.search(start, goal):
+            ids = self.reconstruct_ids(start, goal)
+        else:
+            return None
+
+        if self.cache_size > 0:
+            self.store_path(key, ids, start)
+        return ids
+
+    cpdef list new_path(self, start, goal):
+        cdef list ids = self.new_path_ids(start.id, goal.id)
+        if ids is not None:
+            return [self.cells[i] for i in ids]
+
+    def new_paths_ids(self, starts, goals):
+        """Returns the ids of the paths between each pair of cells, like
+        new_path_ids(). The paths that are not in the cache are searched in a
+        single batch that releases the GIL, spread over the workers if there
+        are any (see set_workers()).
+
+        :param starts: sequence of the ids of the start cells.
+        :param goals: sequence of the ids of the goal cells.
+        """
+        cdef GraphAStar worker
+        cdef Py_ssize_t n = len(starts), k, j
+        cdef list paths = [None] * n, keys = [None] * n, misses = [], repeated = []
+        cdef dict pending = {}
+
+        for k in range(n):
+            if self.cache_size > 0:
+                key = self.cache_key(starts[k], goals[k])
+                offsets = self.cache.get(key)
+                if offsets is not None:
+                    self.cache.move_to_end(key)
+                    self.cache_hits += 1
+                    paths[k] = self.translate_path(offsets, starts[k])
+                    continue
+                if key in pending:
+                    # Taken from the cache when the first path is found
+                    repeated.append(k)
+                    continue
+                pending[key] = k
+                keys[k] = key
+                self.cache_misses += 1
+            misses.append(k)
+
+        miss_starts = np.asarray([starts[k] for k in misses], dtype="int32")
+        miss_goals = np.asarray([goals[k] for k in misses], dtype="int32")
+        if self.executor is not None and len(misses) > 1:
+            chunks = np.array_split(np.arange(len(misses)), len(self.workers))
+            futures = []
+            for worker, chunk in zip(self.workers, chunks):
+                self.share_setup(worker)
+                worker.total_expansions = 0
+                futures.append(self.executor.submit(worker.search_paths, miss_starts[chunk], miss_goals[chunk]))
+            results = [future.result() for future in futures]
+            for worker in self.workers:
+                self.total_expansions += worker.total_expansions
+        else:
+            results = [self.search_paths(miss_starts, miss_goals)]
+
+        j = 0
+        for ids, ends, found in results:
+            for k in range(len(found)):
+                if found[k]:
+                    paths[misses[j]] = ids[ends[k]:ends[k + 1]].tolist()
+                    if self.cache_size > 0:
+                        self.store_path(keys[misses[j]], paths[misses[j]], starts[misses[j]])
+                j += 1
+
+        for k in repeated:
+            paths[k] = self.new_path_ids(starts[k], goals[k])
+        return paths
+
+    def new_paths(self, starts, goals):
+        """Returns the paths between each pair of cells, like new_path(), see
+        new_paths_ids()."""
+        return [None if ids is None else [self.cells[i] for i in ids] for ids in self.new_paths_ids(starts, goals)]
+
+    cpdef list recompute_path(self, list current_path, current_cell, target):
+        """Repairs the path of a vehicle that has left it: a search from the
+        current cell towards the last of the next repair_horizon cells of the
+        path stops at the first of these cells it reaches, and the vehicle goes
+        back to the path there. When no cell of the path is reached after
+        expanding repair_limit cells a new path to the target is computed. """
+        cdef int start = current_cell.id, length = len(current_path)
+        cdef int first = max(0, length - self.repair_horizon)
+        cdef int i, cell, rejoin
+
+        if length == 0:
+            return self.new_path(current_cell, target)
+
+        self.new_generation()
+        for i in range(first, length):
+            cell = current_path[i].id
+            self.path_stamp[cell] = self.generation
+            self.path_index[cell] = i
+
+        rejoin = self.rejoin_search(start, current_path[first].id)
+        if rejoin < 0:
+            self.failed_repairs += 1
+            return self.new_path(current_cell, target)
+
+        self.repairs += 1
+        del current_path[self.path_index[rejoin] + 1:]
+        current_path.extend([self.cells[i] for i in self.reconstruct_ids(start, rejoin)[1:]])
+        return current_path
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void heap_push(long long[:] heap, int size, long long key) nogil:
+    "Adds the key to the binary min heap of the given size."
+    cdef int parent
+    while size > 0:
+        parent = (size - 1) >> 1
+        if heap[parent] <= key:
+            break
+        heap[size] = heap[parent]
+        size = parent
+    heap[size] = key
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef long long heap_pop(long long[:] heap, int size) nogil:
+    "Removes and returns the minimum key of the binary min heap of the given size."
+    cdef long long top = heap[0], last = heap[size - 1]
+    cdef int index = 0, child
+    size -= 1
+    while True:
+        child = 2*index + 1
+        if child >= size:
+            break
+        if child + 1 < size and heap[child + 1] < heap[child]:
+            child += 1
+        if last <= heap[child]:
+            break
+        heap[index] = heap[child]
+        index = child
+    heap[index] = last
+    return top
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void c_dijkstra(int[:] offsets, int[:] neighbours, int[:] cost, int[:] sources,
+                     int[:] dist, int[:] parent, int[:] origin, long long[:] heap) nogil:
+    """Dijkstra's algorithm from the sources following the edges of the adjacency
+    in CSR format. Stores in parent the cell from which each cell is reached and
+    in origin the index of the source it is reached from."""
+    cdef int n = dist.shape[0]
+    cdef int size = 0, cell, i, neighbour, d
+    cdef long long key
+
+    for i in range(n):
+        dist[i] = -1
+        parent[i] = -1
+        origin[i] = -1
+    for i in range(sources.shape[0]):
+        if dist[sources[i]] == -1:
+            dist[sources[i]] = 0
+            origin[sources[i]] = i
+            heap_push(heap, size, sources[i])
+            size += 1
+
+    while size > 0:
+        key = heap_pop(heap, size)
+        size -= 1
+        cell = key % n
+        if key // n > dist[cell]:
+            # Outdated entry of a cell that was reached again with a lower distance
+            continue
+        for i in range(offsets[cell], offsets[cell + 1]):
+            neighbour = neighbours[i]
+            d = dist[cell] + cost[i]
+            if dist[neighbour] == -1 or d < dist[neighbour]:
+                dist[neighbour] = d
+                parent[neighbour] = cell
+                origin[neighbour] = origin[cell]
+                heap_push(heap, size, <long long>d * n + neighbour)
+                size += 1
+
+cdef tuple run_dijkstra(offsets, neighbours, cost, sources):
+    cdef int[:] offsets_view = np.ascontiguousarray(offsets, dtype="int32")
+    cdef int[:] neighbours_view = np.ascontiguousarray(neighbours, dtype="int32")
+    cdef int[:] cost_view = np.ascontiguousarray(cost, dtype="int32")
+    cdef int[:] sources_view = np.ascontiguousarray(sources, dtype="int32")
+    dist = np.empty(len(offsets) - 1, dtype="int32")
+    parent = np.empty(len(offsets) - 1, dtype="int32")
+    origin = np.empty(len(offsets) - 1, dtype="int32")
+    cdef int[:] dist_view = dist, parent_view = parent, origin_view = origin
+    # Every edge and every source push at most one entry in the heap
+    cdef long long[:] heap = np.empty(len(neighbours) + len(sources) + 1, dtype="int64")
+
+    with nogil:
+        c_dijkstra(offsets_view, neighbours_view, cost_view, sources_view, dist_view, parent_view, origin_view, heap)
+
+    return dist, parent, origin
+
+def dijkstra(graph, int source):
+    """Computes the shortest paths from the source to every cell of the graph,
+    with the same costs used by GraphAStar. Returns a tuple (dist, previous) of
+    arrays indexed by the id of the cells: the distance from the source and the
+    previous cell in the shortest path, -1 for the source and unreachable cells. """
+    return run_dijkstra(graph.offsets, graph.neighbours, graph.cost, [source])[:2]
+
+def reverse_dijkstra(graph, int target):
+    """Computes the shortest paths from every cell of the graph to the target,
+    with the same costs used by GraphAStar. Returns a tuple (dist, next_hop) of
+    arrays indexed by the id of the cells: the distance to the target and the
+    next cell in the shortest path, -1 for the target and unreachable cells. """
+    return run_dijkstra(graph.rev_offsets, graph.rev_neighbours, graph.rev_cost, [target])[:2]
+
+def nearest_targets(graph, targets):
+    """Computes the shortest paths from every cell of the graph to the nearest
+    of the targets with a single search from all of them. Returns a tuple (dist,
+    next_hop, nearest) of arrays indexed by the id of the cells: the distance to
+    the nearest target, the next cell in the shortest path (-1 for the targets)
+    and the index in targets of the nearest target. Unreachable cells have -1
+    everywhere. When two targets are at the same distance one of them is chosen. """
+    return run_dijkstra(graph.rev_offsets, graph.rev_neighbours, graph.rev_cost, targets)
+
+def select_landmarks(graph, int k):
+    """Chooses k landmarks for the ALT heuristic far away from each other: the
+    first one is the cell farthest from the cell 0 and each of the next ones is
+    the cell farthest from the landmarks already chosen. """
+    landmarks = []
+    closest = np.full(graph.n_cells, np.iinfo("int32").max, dtype="int64")
+    candidate = int(np.argmax(dijkstra(graph, 0)[0]))
+    for _ in range(k):
+        landmarks.append(candidate)
+        # Round trip distance between each cell and the landmark
+        distance = dijkstra(graph, candidate)[0].astype("int64") + reverse_dijkstra(graph, candidate)[0]
+        np.minimum(closest, distance, out=closest)
+        candidate = int(np.argmax(closest))
+    return landmarks
+
+def next_hop_fields(graph, targets):
+    """Returns an int32 array of shape (len(targets), n_cells) where the row k
+    is the next hop field of reverse_dijkstra() to targets[k]. """
+    fields = np.empty((len(targets), graph.n_cells), dtype="int32")
+    for k, target in enumerate(targets):
+        fields[k] = reverse_dijkstra(graph, target)[1]
+    return fields
+
+
+cdef class TableRouter(AStar):
+    """Computes the paths walking a next hop table, where table[goal, cell] is
+    the next cell from cell in a shortest path to goal. The table is usually
+    memory mapped from the file built by routing.build_next_hop_table(). """
+    cdef public list cells
+    cdef public object table
+    cdef int n_cells
+    cdef const unsigned short[:, :] table16
+    cdef const unsigned int[:, :] table32
+    cdef bint wide
+
+    def __init__(self, max_length, table, cells):
+        """
+        :param table: uint16 or uint32 array of shape (n_cells, n_cells).
+        :param cells: list of Cell objects where the index is the cell id.
+        """
+        super().__init__(max_length)
+        self.cells = cells
+        self.table = table
+        self.n_cells = len(cells)
+        self.wide = table.dtype == np.uint32
+        if self.wide:
+            self.table32 = table
+        else:
+            self.table16 = table
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef list new_path_ids(self, int start, int goal):
+        """Returns the ids of the cells of the path from start to goal, in reverse
+        order and without the start, like AStar.new_path(). """
+        cdef list ids = []
+        cdef int cell = start, steps = 0
+        while cell != goal:
+            if self.wide:
+                cell = self.table32[goal, cell]
+            else:
+                cell = self.table16[goal, cell]
+            steps += 1
+            if cell >= self.n_cells or steps > self.n_cells:
+                # The goal can't be reached from start.
+                return None
+            ids.append(cell)
+        if not ids:
+            ids.append(goal)
+        ids.reverse()
+        return ids
+
+    cpdef list new_path(self, start, goal):
+        cdef list ids = self.new_path_ids(start.id, goal.id)
+        if ids is not None:
+            return [self.cells[i] for i in ids]
+
+    def new_paths(self, starts, goals):
+        """Returns the paths between each pair of cells of the sequences of ids
+        starts and goals, like new_path()."""
+        return [self.new_path(self.cells[start], self.cells[goal]) for start, goal in zip(starts, goals)]
+
+    cpdef list recompute_path(self, list current_path, current_cell, target):
+        "Walking the table is cheaper than repairing the path."
+        return self.new_path(current_cell, target)
+
+
+cdef dict witness_search(list out_edges, list cost, int source, int excluded, int max_cost, int limit):
+    """Dijkstra from source that doesn't go through the excluded cell, it stops
+    at max_cost or after settling limit cells. Returns the distances found, each
+    of them is the cost of a real path even if it isn't the shortest one. """
+    cdef dict dist = {source: 0}
+    cdef list heap = [(0, source)]
+    cdef int settled = 0, d, cell, neighbour, new_d
+    while heap and settled < limit:
+        d, cell = heappop(heap)
+        if d > dist[cell]:
+            continue
+        if d > max_cost:
+            break
+        settled += 1
+        for neighbour, edge in (<dict>out_edges[cell]).items():
+            if neighbour == excluded:
+                continue
+            new_d = d + <int>cost[edge]
+            if neighbour not in dist or new_d < dist[neighbour]:
+                dist[neighbour] = new_d
+                heappush(heap, (new_d, neighbour))
+    return dist
+
+cdef list needed_shortcuts(list in_edges, list out_edges, list cost, int cell, int limit):
+    """Returns the shortcuts (tail, head, cost, first edge, second edge) needed to
+    keep the distances between the neighbours of the cell when it is removed. """
+    cdef list shortcuts = []
+    cdef dict targets, dist
+    cdef int tail, head, c, max_cost
+    for tail, in_edge in (<dict>in_edges[cell]).items():
+        targets = {}
+        max_cost = 0
+        for head, out_edge in (<dict>out_edges[cell]).items():
+            if head != tail:
+                c = cost[in_edge] + cost[out_edge]
+                targets[head] = (c, out_edge)
+                if c > max_cost:
+                    max_cost = c
+        if not targets:
+            continue
+        dist = witness_search(out_edges, cost, tail, cell, max_cost, limit)
+        for head, (c, out_edge) in targets.items():
+            if head not in dist or dist[head] > c:
+                shortcuts.append((tail, head, c, in_edge, out_edge))
+    return shortcuts
+
+cdef int contraction_priority(list in_edges, list out_edges, list cost, list deleted_neighbours, int cell, int limit):
+    "Edge difference of the contraction of the cell plus its contracted neighbours."
+    return (len(needed_shortcuts(in_edges, out_edges, cost, cell, limit))
+            - len(in_edges[cell]) - len(out_edges[cell]) + deleted_neighbours[cell])
+
+def contract_graph(graph, int witness_limit=64):
+    """Builds a contraction hierarchy of the graph, with the same costs used by
+    GraphAStar. The cells are contracted in increasing order of edge difference
+    (shortcuts added minus edges removed) plus contracted neighbours, which is
+    updated lazily. Returns a dict of arrays:
+
+    rank: order in which each cell was contracted.
+    edge_tail, edge_head, edge_cost: the original edges followed by the shortcuts.
+    edge_first, edge_second: the two edges replaced by a shortcut, -1 for the original edges.
+    up_offsets, up_edges: CSR by tail of the edges that go to a cell of higher rank.
+    down_offsets, down_edges: CSR by head of the edges that come from a cell of higher rank.
+
+    :param witness_limit: maximum number of cells settled looking for a path that
+    makes a shortcut unnecessary. Lower values are faster but add more shortcuts.
+    """
+    cdef int n = graph.n_cells
+    cdef list tail = graph.sources().tolist(), head = graph.neighbours.tolist(), cost = graph.cost.tolist()
+    cdef list first = [-1] * len(tail), second = [-1] * len(tail)
+    # Adjacency of the cells that are not contracted yet: {neighbour: edge}
+    cdef list out_edges = [{} for _ in range(n)], in_edges = [{} for _ in range(n)]
+    cdef list deleted_neighbours = [0] * n
+    cdef list queue
+    cdef int edge, cell, neighbour, priority, order = 0
+    rank = np.full(n, -1, dtype="int32")
+
+    for edge in range(len(tail)):
+        if tail[edge] != head[edge] and (head[edge] not in out_edges[tail[edge]]
+                                         or cost[edge] < cost[out_edges[tail[edge]][head[edge]]]):
+            out_edges[tail[edge]][head[edge]] = edge
+            in_edges[head[edge]][tail[edge]] = edge
+
+    queue = [(contraction_priority(in_edges, out_edges, cost, deleted_neighbours, cell, witness_limit), cell)
+             for cell in range(n)]
+    queue.sort()
+    while queue:
+        priority, cell = heappop(queue)
+        # Contract the cell only if it is still the best one after updating its priority
+        priority = contraction_priority(in_edges, out_edges, cost, deleted_neighbours, cell, witness_limit)
+        if queue and priority > queue[0][0]:
+            heappush(queue, (priority, cell))
+            continue
+
+        for t, h, c, e1, e2 in needed_shortcuts(in_edges, out_edges, cost, cell, witness_limit):
+            if h in out_edges[t] and cost[out_edges[t][h]] <= c:
+                continue
+            out_edges[t][h] = in_edges[h][t] = len(tail)
+            tail.append(t)
+            head.append(h)
+            cost.append(c)
+            first.append(e1)
+            second.append(e2)
+
+        for neighbour in in_edges[cell]:
+            del out_edges[neighbour][cell]
+            deleted_neighbours[neighbour] += 1
+        for neighbour in out_edges[cell]:
+            del in_edges[neighbour][cell]
+            deleted_neighbours[neighbour] += 1
+        rank[cell] = order
+        order += 1
+
+    hierarchy = {"rank": rank,
+                 "edge_tail": np.array(tail, dtype="int32"), "edge_head": np.array(head, dtype="int32"),
+                 "edge_cost": np.array(cost, dtype="int32"),
+                 "edge_first": np.array(first, dtype="int32"), "edge_second": np.array(second, dtype="int32")}
+    sources, targets = hierarchy["edge_tail"], hierarchy["edge_head"]
+    for direction, start, end in [("up", sources, targets), ("down", targets, sources)]:
+        edges = np.flatnonzero(rank[end] > rank[start]).astype("int32")
+        edges = edges[np.argsort(start[edges], kind="stable")]
+        offsets = np.zeros(n + 1, dtype="int32")
+        np.cumsum(np.bincount(start[edges], minlength=n), out=offsets[1:])
+        hierarchy[direction + "_offsets"], hierarchy[direction + "_edges"] = offsets, edges
+    return hierarchy
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef class ContractionRouter(AStar):
+    """Computes the paths with a bidirectional search over a contraction
+    hierarchy (see contract_graph()): the forward search only follows edges to
+    cells of higher rank and the backward search edges from cells of higher
+    rank. The shortcuts of the path found are unpacked into the original cells. """
+    cdef public list cells
+    cdef int n_cells
+    cdef int[:] up_offsets, up_edges, down_offsets, down_edges
+    cdef int[:] edge_tail, edge_head, edge_cost, edge_first, edge_second
+    # Scores of each direction, valid when the stamp of the cell is the current generation.
+    cdef int[:] forward_dist, backward_dist, forward_edge, backward_edge, forward_seen, backward_seen
+    cdef int generation
+    cdef long long[:] forward_heap, backward_heap
+
+    def __init__(self, max_length, hierarchy, cells):
+        """
+        :param hierarchy: dict of arrays returned by contract_graph()
+        :param cells: list of Cell objects where the index is the cell id.
+        """
+        super().__init__(max_length)
+        self.cells = cells
+        self.n_cells = len(cells)
+        self.up_offsets = np.ascontiguousarray(hierarchy["up_offsets"], dtype="int32")
+        self.up_edges = np.ascontiguousarray(hierarchy["up_edges"], dtype="int32")
+        self.down_offsets = np.ascontiguousarray(hierarchy["down_offsets"], dtype="int32")
+        self.down_edges = np.ascontiguousarray(hierarchy["down_edges"], dtype="int32")
+        self.edge_tail = np.ascontiguousarray(hierarchy["edge_tail"], dtype="int32")
+        self.edge_head = np.ascontiguousarray(hierarchy["edge_head"], dtype="int32")
+        self.edge_cost = np.ascontiguousarray(hierarchy["edge_cost"], dtype="int32")
+        self.edge_first = np.ascontiguousarray(hierarchy["edge_first"], dtype="int32")
+        self.edge_second = np.ascontiguousarray(hierarchy["edge_second"], dtype="int32")
+
+        self.forward_dist = np.zeros(self.n_cells, dtype="int32")
+        self.backward_dist = np.zeros(self.n_cells, dtype="int32")
+        self.forward_edge = np.zeros(self.n_cells, dtype="int32")
+        self.backward_edge = np.zeros(self.n_cells, dtype="int32")
+        self.forward_seen = np.zeros(self.n_cells, dtype="int32")
+        self.backward_seen = np.zeros(self.n_cells, dtype="int32")
+        self.generation = 0
+        # Every edge pushes at most one entry in the heap of its direction
+        self.forward_heap = np.zeros(len(hierarchy["up_edges"]) + 1, dtype="int64")
+        self.backward_heap = np.zeros(len(hierarchy["down_edges"]) + 1, dtype="int64")
+
+    cdef void new_generation(self) nogil:
+        "Invalidates the scores of the previous search."
+        cdef int i
+        if self.generation == 2147483647:
+            for i in range(self.n_cells):
+                self.forward_seen[i] = 0
+                self.backward_seen[i] = 0
+            self.generation = 0
+        self.generation += 1
+
+    cdef int search(self, int start, int goal) nogil:
+        """Runs the bidirectional search. Returns the cell where the shortest path
+        from start to goal changes from the forward to the backward search, -1
+        if the goal can't be reached."""
+        cdef long long n = self.n_cells, key
+        cdef int forward_size = 1, backward_size = 1, best = -1, meeting = -1
+        cdef int cell, edge, i, neighbour, d
+        cdef bint forward
+
+        self.new_generation()
+        self.forward_dist[start] = 0
+        self.forward_edge[start] = -1
+        self.forward_seen[start] = self.generation
+        self.forward_heap[0] = start
+        self.backward_dist[goal] = 0
+        self.backward_edge[goal] = -1
+        self.backward_seen[goal] = self.generation
+        self.backward_heap[0] = goal
+
+        while forward_size > 0 or backward_size > 0:
+            # Advance the direction with the lowest distance, until none can improve the best path
+            if backward_size == 0:
+                forward = True
+            elif forward_size == 0:
+                forward = False
+            else:
+                forward = self.forward_heap[0] <= self.backward_heap[0]
+            key = self.forward_heap[0] if forward else self.backward_heap[0]
+            if best >= 0 and key // n >= best:
+                break
+
+            if forward:
+                key = heap_pop(self.forward_heap, forward_size)
+                forward_size -= 1
+                cell = key % n
+                if key // n > self.forward_dist[cell]:
+                    continue
+                if self.backward_seen[cell] == self.generation:
+                    d = self.forward_dist[cell] + self.backward_dist[cell]
+                    if best < 0 or d < best:
+                        best, meeting = d, cell
+                for i in range(self.up_offsets[cell], self.up_offsets[cell + 1]):
+                    edge = self.up_edges[i]
+                    neighbour = self.edge_head[edge]
+                    d = self.forward_dist[cell] + self.edge_cost[edge]
+                    if self.forward_seen[neighbour] != self.generation or d < self.forward_dist[neighbour]:
+                        self.forward_seen[neighbour] = self.generation
+                        self.forward_dist[neighbour] = d
+                        self.forward_edge[neighbour] = edge
+                        heap_push(self.forward_heap, forward_size, d * n + neighbour)
+                        forward_size += 1
+            else:
+                key = heap_pop(self.backward_heap, backward_size)
+                backward_size -= 1
+                cell = key % n
+                if key // n > self.backward_dist[cell]:
+                    continue
+                if self.forward_seen[cell] == self.generation:
+                    d = self.forward_dist[cell] + self.backward_dist[cell]
+                    if best < 0 or d < best:
+                        best, meeting = d, cell
+                for i in range(self.down_offsets[cell], self.down_offsets[cell + 1]):
+                    edge = self.down_edges[i]
+                    neighbour = self.edge_tail[edge]
+                    d = self.backward_dist[cell] + self.edge_cost[edge]
+                    if self.backward_seen[neighbour] != self.generation or d < self.backward_dist[neighbour]:
+                        self.backward_seen[neighbour] = self.generation
+                        self.backward_dist[neighbour] = d
+                        self.backward_edge[neighbour] = edge
+                        heap_push(self.backward_heap, backward_size, d * n + neighbour)
+                        backward_size += 1
+        return meeting
+
+    cdef void unpack(self, int edge, list ids):
+        "Appends to ids the heads of the original edges replaced by the edge, in order."
+        cdef list stack = [edge]
+        while stack:
+            edge = stack.pop()
+            if self.edge_first[edge] < 0:
+                ids.append(self.edge_head[edge])
+            else:
+                stack.append(self.edge_second[edge])
+                stack.append(self.edge_first[edge])
+
+    cpdef list new_path_ids(self, int start, int goal):
+        """Returns the ids of the cells of the path from start to goal, in reverse
+        order and without the start, like AStar.new_path(). """
+        cdef list edges = [], ids = []
+        cdef int cell, edge
+        if start == goal:
+            return [goal]
+
+        cell = self.search(start, goal)
+        if cell < 0:
+            return None
+        meeting = cell
+        # Edges from the start to the meeting cell and from there to the goal
+        while self.forward_edge[cell] >= 0:
+            edge = self.forward_edge[cell]
+            edges.append(edge)
+            cell = self.edge_tail[edge]
+        edges.reverse()
+        cell = meeting
+        while self.backward_edge[cell] >= 0:
+            edge = self.backward_edge[cell]
+            edges.append(edge)
+            cell = self.edge_head[edge]
+
+        for edge in edges:
+            self.unpack(edge, ids)
+        ids.reverse()
+        return ids
+
+    cpdef list new_path(self, start, goal):
+        cdef list ids = self.new_path_ids(start.id, goal.id)
+        if ids is not None:
+            return [self.cells[i] for i in ids]
+
+    def new_paths(self, starts, goals):
+        """Returns the paths between each pair of cells of the sequences of ids
+        starts and goals, like new_path()."""
+        return [self.new_path(self.cells[start], self.cells[goal]) for start, goal in zip(starts, goals)]
+
+    cpdef list recompute_path(self, list current_path, current_cell, target):
+        "A new query is cheaper than repairing the path."
+        return self.new_path(current_cell, target)
@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 import copy
+import heapq
 import numpy as np
-import random
 
 from src.models.states import States
-from src.simulator.cythonGraphFunctions import AStar
+from src.simulator.cythonGraphFunctions import ContractionRouter, GraphAStar, TableRouter, next_hop_fields, \
+    select_landmarks
+from src.simulator.routing import load_contraction_hierarchy, load_next_hop_table
+from src.simulator.sampling import TruncatedNormalSampler
+from src.simulator.scheduler import TimingWheel
 
 class SimulatorEngine:
 
-    def __init__(self, simulation):
+    def __init__(self, simulation, router="astar"):
         """
         :param simulation: A simulation object
+        :param router: algorithm used to compute the paths, see create_router()
          """
         super().__init__()
 
@@ -20,6 +25,12 @@ class SimulatorEngine:
         self.avenues = self.simulation.avenues
         self.roundabouts = self.simulation.roundabouts
         self.SEARCH_ALTERNATIVE_PRIO = 0.3
+        self.PATH_CACHE_SIZE = 20000
+        self.ALT_LANDMARKS = 8
+        # Searching from both ends pays off when there are no landmarks.
+        self.BIDIRECTIONAL_SEARCH = False
+        # Threads that search the paths requested in each step.
+        self.ROUTING_THREADS = 1
         # Control the updating of the cell's occupation state.
         self.new_occupations = []
         self.new_releases = []
@@ -28,11 +39,54 @@ class SimulatorEngine:
         self.general_update = []
         self.new_general_update = []
 
-        # A list of cells to take random destinations.
+        # Pairs (vehicle, target) of the vehicles that need a new path, the
+        # paths are computed in a single batch at the end of each step.
+        self.route_requests = []
+
+        # Vehicles idle at a destination or charging, woken up when their
+        # waiting time is over.
+        self.idle_vehicles = TimingWheel(self.simulation.IDLE_UPPER + 1)
+
+        # Samplers of the idle time at a destination and the goal charge.
+        # The random numbers come from the streams of the simulation.
+        self.rng = simulation.rng
+        self.idle_sampler = TruncatedNormalSampler(self.simulation.IDLE_MEAN, self.simulation.IDLE_STD,
+                                                   self.simulation.IDLE_LOWER, self.simulation.IDLE_UPPER,
+                                                   generator=self.rng.idle)
+        self.battery_sampler = TruncatedNormalSampler(self.simulation.BATTERY_MEAN, self.simulation.BATTERY_STD,
+                                                      self.simulation.BATTERY_LOWER, self.simulation.BATTERY_UPPER,
+                                                      generator=self.rng.battery)
+        # Position of each vehicle in the update cycle. The vehicles are updated
+        # in increasing order and new vehicles are added at the end.
+        self.update_order = {}
+        self.last_update_order = 0
+
+        # Index of each station in the list of stations.
+        self.stations_index = {st: i for (i, st) in enumerate(self.simulation.stations)}
+        # Indices of the stations whose queue or chargers have changed, only
+        # these stations are updated in each step.
+        self.dirty_stations = set()
+        # Current time step of the simulation.
+        self.tstep = 0
+
+        # A list of cells to take random destinations, the index of each cell is its id.
         self.city_cells = list(simulation.city_map.values())
-        
-        # Object that models the A* path algorithm 
-        self.astar = AStar(200)
+
+        # Occupation state of the city indexed by the id of the cells. The number
+        # of blocking cells of a cell is the number of occupied cells among the
+        # cell and its priority predecessors, a vehicle can only enter a cell
+        # without priority if it has no blocking cells.
+        self.occupied = np.zeros(len(self.city_cells), dtype=bool)
+        self.blocking = np.zeros(len(self.city_cells), dtype="int32")
+        # The cells blocked by the cell i are blocks[blocks_offsets[i]:blocks_offsets[i+1]]
+        self.blocks_offsets, self.blocks = self.compute_blocks()
+
+        # Object that computes the paths of the vehicles
+        self.astar = self.create_router(router)
+        # Vehicles heading to a station don't have a path, they follow the shortest
+        # paths to the station: station_fields[k, i] is the next cell from the cell i
+        # towards the station k.
+        self.station_fields = self.compute_station_fields()
         # Global data from the simulation
         self.seeking_history = None
         self.queueing_history = None
@@ -44,18 +98,98 @@ class SimulatorEngine:
                               States.CHARGING: self.charging,
                               States.NO_BATTERY: self.no_battery}
 
+    def compute_station_fields(self):
+        """Returns the next hop fields of the stations, see next_hop_fields().
+        Every cell must reach every station, otherwise its next hop would be -1
+        and the vehicles would be sent to the last cell of the city."""
+        stations = np.array([st.cell.id for st in self.simulation.stations], dtype="int64")
+        fields = next_hop_fields(self.simulation.graph, stations.tolist())
+        # The station itself doesn't have a next hop.
+        unreachable = fields < 0
+        unreachable[np.arange(len(stations)), stations] = False
+        if unreachable.any():
+            k, cell_id = np.argwhere(unreachable)[0].tolist()
+            raise ValueError("The cell {} can't reach the station at {}".format(
+                self.city_cells[cell_id].pos, self.simulation.stations[k].cell.pos))
+        return fields
+
+    def create_router(self, router):
+        """Returns the object that computes the paths of the vehicles: "astar"
+        searches each path, "table" walks the next hop table of the city and
+        "contraction" searches over its contraction hierarchy. The table and the
+        hierarchy are read from the cache of the simulation, see
+        routing.load_next_hop_table() and routing.load_contraction_hierarchy()."""
+        graph = self.simulation.graph
+        if router == "table":
+            table = load_next_hop_table(graph, self.simulation.city_cache_filename("next_hop", "npy"))
+            return TableRouter(200, table, self.city_cells)
+        elif router == "contraction":
+            hierarchy = load_contraction_hierarchy(graph, self.simulation.city_cache_filename("contraction", "npz"))
+            return ContractionRouter(200, hierarchy, self.city_cells)
+        elif router != "astar":
+            raise ValueError("Unknown router: {}".format(router))
+
+        # Object that models the A* path algorithm
+        astar = GraphAStar(200, graph, self.city_cells)
+        # Landmarks that improve the heuristic of the search (ALT)
+        if self.ALT_LANDMARKS:
+            astar.set_landmarks(graph, select_landmarks(graph, self.ALT_LANDMARKS))
+        astar.bidirectional = self.BIDIRECTIONAL_SEARCH
+        # The city is a tiling of the base city, so paths can be reused by translation.
+        astar.set_path_cache(self.simulation.city_builder.base_size, self.PATH_CACHE_SIZE)
+        astar.set_workers(graph, self.ROUTING_THREADS)
+        return astar
+
     def restart(self):
         self.new_occupations = []
         self.new_releases = []
+        self.occupied[:] = False
+        self.blocking[:] = 0
 
-        self.general_update = self.simulation.vehicles
+        self.general_update = []
         self.new_general_update = []
-        
+        self.route_requests = []
+
+        self.idle_vehicles.restart()
+        self.idle_sampler.restart()
+        self.battery_sampler.restart()
+        self.restart_update_order()
+        self.dirty_stations = set()
+        self.tstep = 0
+
         self.seeking_history = {v.id:[] for v in self.simulation.ev_vehicles}
         self.queueing_history = {v.id: [] for v in self.simulation.ev_vehicles}
 
-    def choose_station(self, pos):
-        return random.choice(self.simulation.stations_map[pos])
+    def restart_update_order(self):
+        """Initially every vehicle is waiting at a destination, in the order
+        of the list of vehicles."""
+        self.update_order = {}
+        self.last_update_order = 0
+        for vehicle in self.simulation.vehicles:
+            self.add_to_update_order(vehicle)
+            self.wait(vehicle, vehicle.wait_time)
+
+    def add_to_update_order(self, vehicle):
+        """Places the vehicle at the end of the update cycle."""
+        self.last_update_order += 1
+        self.update_order[vehicle] = self.last_update_order
+
+    def wait(self, vehicle, wait_time):
+        """The vehicle leaves the update cycle until wait_time steps have
+        passed. A vehicle with a wait_time lower than one waits forever."""
+        vehicle.wait_time = wait_time
+        self.idle_vehicles.schedule(vehicle, self.update_order[vehicle], wait_time)
+
+    def fill_snapshot(self, state, cell):
+        """Writes the value of the state and the cell id of each vehicle in the
+        arrays state and cell, in the order of the list of vehicles."""
+        vehicles = self.simulation.vehicles
+        state[:] = np.fromiter((v.state.value for v in vehicles), dtype=state.dtype, count=len(vehicles))
+        cell[:] = np.fromiter((v.cell.id for v in vehicles), dtype=cell.dtype, count=len(vehicles))
+
+    def choose_station(self, cell_id):
+        """Returns one of the stations of the cluster that serves the cell."""
+        return self.rng.routing_sampler.choice(self.simulation.station_districts[self.simulation.stations_map[cell_id]])
 
     def towards_destination(self, vehicle):
         """Function called when a vehicle has State.TOWARDS_DEST."""
@@ -69,15 +203,17 @@ class SimulatorEngine:
 
             # set the vehicles' state to at destination
             vehicle.state = States.AT_DEST
-            # set the amount of time the vehicle must stay idle at destination
-            vehicle.wait_time = self.compute_idle()
-            
+            # the vehicle stays idle at the destination, out of the update cycle
+            self.wait(vehicle, self.compute_idle())
+            return
+
         elif electric:
             if vehicle.battery <= self.simulation.BATTERY_LOWER:
                 # The vehicle is running out of battery and needs to recharge
                 vehicle.state = States.TOWARDS_ST  # Set the state to "towards station"
-                vehicle.station = self.choose_station(vehicle.cell.pos)  # Choose the station
-                vehicle.path = self.astar.new_path(vehicle.cell, vehicle.station.cell)
+                vehicle.station = self.choose_station(vehicle.cell.id)  # Choose the station
+                vehicle.path = []  # The path to the destination is computed again after charging
+                vehicle.recompute_path = False
                 vehicle.seeking = 0  # Start the seeking counter
 
             elif vehicle.battery == 0:
@@ -98,16 +234,13 @@ class SimulatorEngine:
         # The vehicle is no longer part of the general update list
 
     def at_destination(self, vehicle):
-        """Function called when a vehicle is idle at a destination has so has
-        the State.AT_DEST."""
-        vehicle.wait_time -= 1
-
-        if vehicle.wait_time == 0:
-            # The waiting is over, choose a new destination
-            vehicle.state = States.TOWARDS_DEST
-            vehicle.destination = random.choice(self.city_cells)
-            
-            vehicle.path = self.astar.new_path(vehicle.cell, vehicle.destination)
+        """Function called when the idle time of a vehicle with State.AT_DEST
+        is over."""
+        # The waiting is over, choose a new destination
+        vehicle.state = States.TOWARDS_DEST
+        vehicle.destination = self.rng.routing_sampler.choice(self.city_cells)
+
+        self.request_route(vehicle, vehicle.destination)
 
         # Add the vehicle to the general update cycle.
         self.new_general_update.append(vehicle)
@@ -117,7 +250,7 @@ class SimulatorEngine:
         """Function called when a vehicle has State.TOWARDS_ST."""
         vehicle.seeking += 1
 
-        if self.compute_next_position(vehicle, vehicle.station.cell):
+        if self.compute_next_position_to_station(vehicle):
             # Free up the position
             self.new_releases.append(vehicle.cell)
 
@@ -125,9 +258,9 @@ class SimulatorEngine:
             self.seeking_history[vehicle.id].append(vehicle.seeking)
             vehicle.state = States.QUEUEING
 
-            # Start the counter for queueing
-            vehicle.queueing = 0
-            vehicle.station.queue.append(vehicle)
+            # Join the queue of the station
+            vehicle.station.enqueue(vehicle, self.tstep)
+            self.dirty_stations.add(self.stations_index[vehicle.station])
 
         else:
             if vehicle.battery == 0:
@@ -138,160 +271,173 @@ class SimulatorEngine:
             # the station.
             self.new_general_update.append(vehicle)
 
+    def update_stations(self):
+        """Updates the stations that have changed, in the order of the list of
+        stations. A station stays changed while it has vehicles queueing and
+        available chargers."""
+        stations = self.simulation.stations
+        dirty_stations = set()
+        for index in sorted(self.dirty_stations):
+            station = stations[index]
+            self.update_at_station(station)
+            if station.queue and station.available > 0:
+                dirty_stations.add(index)
+
+        self.dirty_stations = dirty_stations
+
     def update_at_station(self, station):
         """Update the vehicles that are inside the station queueing"""
 
         if len(station.queue):
-            # Increase the queueing counter of each vehicle.
-            for vehicle in station.queue:
-                vehicle.queueing += 1
-
             # Assign a new charger to the first vehicle in the queue
             if station.charger_available():
-                vehicle = station.queue.popleft() # Retrieve the first vehicle.
-                self.queueing_history[vehicle.id].append(vehicle.queueing) 
+                vehicle, vehicle.queueing = station.dequeue(self.tstep) # Retrieve the first vehicle.
+                self.queueing_history[vehicle.id].append(vehicle.queueing)
 
                 vehicle.state = States.CHARGING # Set the state to charging
                 goal_charge = self.compute_battery() # Compute the goal charge and wait time.
-                vehicle.wait_time = int(self.simulation.units.steps_to_recharge(goal_charge-vehicle.battery))
+                wait_time = int(self.simulation.units.steps_to_recharge(goal_charge-vehicle.battery))
                 vehicle.battery = goal_charge
 
-                # Add the vehicle to the general update list.
-                self.new_general_update.append(vehicle)
+                # The vehicle returns to the end of the update cycle once it is charged.
+                self.add_to_update_order(vehicle)
+                self.wait(vehicle, wait_time)
 
 
     def charging(self, vehicle):
-        """Function called when a vehicle has State.CHARGING."""
-        vehicle.wait_time -= 1
-        if vehicle.wait_time == 0:
-            # The vehicle has waited long enough
-            vehicle.station.vehicle_leaving()
-            vehicle.station = None
-            vehicle.state = States.TOWARDS_DEST
-            
-            vehicle.path = self.astar.new_path(vehicle.cell, vehicle.destination)
+        """Function called when a vehicle with State.CHARGING has waited long
+        enough."""
+        vehicle.station.vehicle_leaving()
+        self.dirty_stations.add(self.stations_index[vehicle.station])
+        vehicle.station = None
+        vehicle.state = States.TOWARDS_DEST
+
+        self.request_route(vehicle, vehicle.destination)
 
         # Add the vehicle to the general update list
         self.new_general_update.append(vehicle)
 
+    def request_route(self, vehicle, target):
+        """The path of the vehicle to the target is computed at the end of the
+        step, the vehicle doesn't move until the next step."""
+        self.route_requests.append((vehicle, target))
+
+    def compute_routes(self):
+        """Computes the paths requested in this step in a single batch."""
+        if not self.route_requests:
+            return
+        paths = self.astar.new_paths([vehicle.cell.id for (vehicle, _) in self.route_requests],
+                                     [target.id for (_, target) in self.route_requests])
+        for (vehicle, _), path in zip(self.route_requests, paths):
+            vehicle.path = path
+        self.route_requests = []
+
     def compute_idle(self):
         """Returns the time a vehicle must spent idle when it reaches a
         destination.
 
-        This follows a normal distribution
+        This follows a normal distribution truncated to [IDLE_LOWER, IDLE_UPPER]
         """
-
-        # Compute a normal random number
-        r = int(np.random.normal(self.simulation.IDLE_MEAN, self.simulation.IDLE_STD))
-
-        # Truncate the maximum and minimum values of the distribution.
-        while r < self.simulation.IDLE_LOWER or r > self.simulation.IDLE_UPPER:
-            r = int(np.random.normal(self.simulation.IDLE_MEAN, self.simulation.IDLE_STD))
-
-        return r
+        return self.idle_sampler()
 
     def compute_battery(self):
         """Returns the amount of charge that an EV has in its battery.
 
-        This follows a normal distribution.
+        This follows a normal distribution truncated to [BATTERY_LOWER, BATTERY_UPPER].
         """
-        r = int(np.random.normal(self.simulation.BATTERY_MEAN,
-                                 self.simulation.BATTERY_STD))
+        return self.battery_sampler()
 
-        # Truncate the maximum and minimum values of the distribution.
-        while r < self.simulation.BATTERY_LOWER or r > self.simulation.BATTERY_UPPER:
-            r = int(np.random.normal(self.simulation.BATTERY_MEAN,
-                                     self.simulation.BATTERY_STD))
+    def compute_next_position(self, vehicle,  target, electric=True):
+        """Moves the vehicle one step along its path towards the target. Returns
+        True if the vehicle is at the target after the movement."""
 
-        return r
+        # Recompute the path if we have diverted from the path in the previous step.
+        if vehicle.recompute_path:
+            vehicle.path = self.astar.recompute_path(vehicle.path, vehicle.cell, target)
+            vehicle.recompute_path = False
 
-    def compute_next_position(self, vehicle,  target, electric=True):
-        """Given a."""
+        # Get the next step in the path to our goal
+        next_cell = vehicle.path.pop(-1)
+        choice = self.move(vehicle, next_cell, electric)
+
+        if choice is None:
+            # The vehicle's position is the same as before entering this function.
+            vehicle.path.append(next_cell)  # restore the path
+        else:
+            # The vehicle did move. If the path is changed then it must be recomputed in the next step.
+            vehicle.recompute_path = choice is not next_cell
 
-        # A flag to know whether the vehicle moved to a new position.
-        vehicle_moved = False
+        return vehicle.cell == target
+
+    def compute_next_position_to_station(self, vehicle):
+        """Moves the vehicle one step towards its station following the shortest
+        paths to the station, so a vehicle that diverts doesn't need a new path.
+        Returns True if the vehicle is at the station after the movement."""
+        target = vehicle.station.cell
+        if vehicle.cell is not target:
+            field = self.station_fields[self.stations_index[vehicle.station]]
+            self.move(vehicle, self.city_cells[field[vehicle.cell.id]])
+
+        return vehicle.cell is target
+
+    def move(self, vehicle, next_cell, electric=True):
+        """Tries to move the vehicle to next_cell applying the traffic rules.
+        Returns the cell the vehicle has moved to or None if it can't move."""
+        choice = self.resolve_movement(vehicle.cell, next_cell)
+        if choice is not None:
+            self.assign_new_cell(vehicle, choice)
+            if electric:
+                vehicle.battery -= 1
+
+        return choice
+
+    def resolve_movement(self, cell, next_cell):
+        """Given the current cell of a vehicle and the next cell in its path,
+        applies the traffic rules and returns the cell the vehicle moves to.
+        The returned cell is next_cell when the vehicle follows its path, another
+        successor of cell when it diverts from it and None when it can't move."""
 
         def keep_in_lane_is_possible(next_prio_cell):
             """Given a priority cell next to the current cell, returns True
             if we can keep in lane and occupy the next cell. """
-            return not next_prio_cell.occupied
-        
+            return not self.occupied[next_prio_cell.id]
+
         def lane_change_is_possible(choice):
             """ Given a cell, checks if it is possible to move to that cell provided
             that we dont have priority.  """
-            return (not choice.occupied) and (not any([cell.occupied for cell in choice.prio_predecessors ]))
-
-
-        def follow_path(vehicle, next_cell):
-            """Function called when the vehicle moves exactly to the next cell in its path."""
-            nonlocal vehicle_moved
-
-            self.assign_new_cell(vehicle, next_cell)
-            vehicle_moved = True
-
-        def divert_from_path(vehicle, next_cell):
-            """Function called when a vehicle moves to a cell different to the next in its path. """
-            nonlocal vehicle_moved
+            return self.blocking[choice.id] == 0
 
-            self.assign_new_cell(vehicle, next_cell)
-            vehicle.recompute_path = True
-            vehicle_moved = True
-
-        def search_an_alternative(vehicle, alternative):
-            """ Given a vehicle and an alternative position, checks if the movement is possible """
-            if alternative in vehicle.cell.prio_successors:
+        def search_an_alternative(alternative):
+            """ Given an alternative position, checks if the movement is possible """
+            if alternative in cell.prio_successors:
                 return keep_in_lane_is_possible(alternative)
             else:
                 return lane_change_is_possible(alternative)
 
-        # Recompute the path if we have diverted from the path in the previous step.
-        if vehicle.recompute_path:
-            vehicle.path = self.astar.recompute_path(vehicle.path, vehicle.cell, target)
-            vehicle.recompute_path = False
-            
-
-        # Get the next step in the path to our goal
-        
-        next_cell = vehicle.path.pop(-1)
-        
-        if next_cell in vehicle.cell.prio_successors:
+        if next_cell in cell.prio_successors:
             # The vehicle tries to keep in lane and move to the forward position.
             if keep_in_lane_is_possible(next_cell):
-                follow_path(vehicle, next_cell)
+                return next_cell
                 
-            elif random.random() < self.SEARCH_ALTERNATIVE_PRIO:
+            elif self.rng.lanes_sampler() < self.SEARCH_ALTERNATIVE_PRIO:
                 # The vehicle tries to change lane with a certain probability
-                for n_cell in vehicle.cell.successors:
-                    alternative_found = search_an_alternative(vehicle, n_cell)
-                    if alternative_found:
-                        divert_from_path(vehicle, n_cell)
-                        break
-                    
+                for n_cell in cell.successors:
+                    if search_an_alternative(n_cell):
+                        return n_cell
                 
         else:
             # Case when the next position is not a priority, the vehicle must give way.
             if lane_change_is_possible(next_cell):
-                follow_path(vehicle, next_cell)
-                
+                return next_cell
             
-            elif vehicle.cell.prio_successors and (random.random() <= self.SEARCH_ALTERNATIVE_PRIO):
+            elif cell.prio_successors and (self.rng.lanes_sampler() <= self.SEARCH_ALTERNATIVE_PRIO):
                 # There is no safe way to change lane, so the vehicle must stay in his lane.
-                prio_alternative_choice = random.choice(vehicle.cell.prio_successors)
+                prio_alternative_choice = self.rng.lanes_sampler.choice(cell.prio_successors)
 
                 if keep_in_lane_is_possible(prio_alternative_choice):
-                    divert_from_path(vehicle, vehicle.cell.prio_successors[0])
-                
-   
-
-        if not vehicle_moved:
-            # The vehicle's position is the same as before entering this function.
-            vehicle.path.append(next_cell)  # restore the path
-        else:
-            # The vehicle did move. If the path is changed then it must be recomputed in the next step.
-            if electric:
-                vehicle.battery -= 1
+                    return cell.prio_successors[0]
 
-        return vehicle.cell == target
+        return None
 
     def move_to_random(self, vehicle):
         """Move the vehicle to an available position in the neighbourhood. Returns True if there is
@@ -299,7 +445,7 @@ class SimulatorEngine:
         candidates = [pos for (pos, tp) in self.simulation.city_map[vehicle.pos] if self.current_city_state[pos]]
         # DEPRECATED
         if len(candidates):
-            self.update_city_and_vehicle(vehicle, random.choice(candidates))
+            self.update_city_and_vehicle(vehicle, self.rng.lanes_sampler.choice(candidates))
             vehicle.recompute_path = True
             return True
         else:
@@ -315,20 +461,53 @@ class SimulatorEngine:
         """Based on the cells marked by the vehicles, update the dictionary of the
         state of the city accordingly."""
 
-        for cell in self.new_occupations:
-            cell.occupied = True
-        for cell in self.new_releases:
-            cell.occupied = False
-        
+        self.apply_occupations()
+
         # Prepare the simulation for the next step.
         self.general_update = self.new_general_update
         self.new_general_update = []
-        
+
+    def compute_blocks(self):
+        """Computes, in CSR format, the cells blocked by each cell when it is
+        occupied: the cell itself and the cells that have it as a priority
+        predecessor. Returns a tuple (offsets, blocks)"""
+        sources = [c.id for c in self.city_cells] + [p.id for c in self.city_cells for p in c.prio_predecessors]
+        blocks = [c.id for c in self.city_cells] + [c.id for c in self.city_cells for p in c.prio_predecessors]
+        sources, blocks = np.array(sources, dtype="int32"), np.array(blocks, dtype="int32")
+
+        offsets = np.zeros(len(self.city_cells) + 1, dtype="int32")
+        np.cumsum(np.bincount(sources, minlength=len(self.city_cells)), out=offsets[1:])
+        return offsets, blocks[np.argsort(sources, kind="stable")]
+
+    def apply_occupations(self):
+        """Marks the cells occupied and released during the last movements and
+        updates the number of blocking cells of the cells they block."""
+        n_occupations = len(self.new_occupations)
+        ids = np.fromiter((c.id for c in self.new_occupations + self.new_releases), dtype="int32",
+                          count=n_occupations + len(self.new_releases))
         self.new_releases, self.new_occupations = [], []
+        if not len(ids):
+            return
+
+        changed = np.unique(ids)
+        before = self.occupied[changed]
+        self.occupied[ids[:n_occupations]] = True
+        self.occupied[ids[n_occupations:]] = False
+        delta = self.occupied[changed].astype("int32") - before
+        changed, delta = changed[delta != 0], delta[delta != 0]
+
+        # Add the change to every cell blocked by the changed cells
+        starts, ends = self.blocks_offsets[changed], self.blocks_offsets[changed + 1]
+        lengths = ends - starts
+        index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        self.blocking += np.bincount(self.blocks[index], weights=np.repeat(delta, lengths),
+                                     minlength=len(self.blocking)).astype(self.blocking.dtype)
 
     def next_step(self):
         """For each vehicle, computes the next step in their algorithm."""
-        
+        self.tstep += 1
+
+
         # Advance only the vehicles in the avenues
         for vehicle in self.general_update:
             if vehicle.state in States.moving_states() and (vehicle.cell in self.avenues or vehicle.cell in self.roundabouts):
@@ -338,12 +517,15 @@ class SimulatorEngine:
         # Update the city state
         self.update_city_state()
 
-        # Now advance all the vehicles
+        # Now advance all the vehicles, including the ones whose waiting is over
+        woken = self.idle_vehicles.advance()
+        if woken:
+            self.general_update = heapq.merge(self.general_update, woken, key=self.update_order.__getitem__)
         for vehicle in self.general_update:
             self.next_function[vehicle.state](vehicle)
             
-        for st in self.simulation.stations:
-            self.update_at_station(st)
+        self.update_stations()
+        self.compute_routes()
 
         # Set the current city state to the new one
         self.update_city_state()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from src.models.cities import CellType
+from src.models.fleet import Fleet
+from src.models.states import States
+from src.simulator.engine import SimulatorEngine
+
+
+class FleetSimulatorEngine(SimulatorEngine):
+
+    def __init__(self, simulation, router="astar"):
+        """Simulator engine that keeps the state of the fleet in NumPy arrays
+        (see models.fleet.Fleet). Idle vehicles wait in the timing wheel of the
+        engine and only the vehicles that move or change their state are visited
+        one by one.
+
+        The Vehicle objects are kept in sync (state and cell) when a vehicle
+        moves or changes its state, so that the metrics and the visualization
+        can keep reading them.
+
+        :param simulation: A simulation object
+        :param router: see SimulatorEngine.create_router()
+        """
+        super().__init__(simulation, router)
+
+        # Cells where the vehicles move twice per step, indexed by cell id.
+        self.fast_cells = np.isin(simulation.graph.cell_type, (CellType.AVENUE.value, CellType.ROUNDABOUT.value))
+
+        # Attributes filled in the method restart()
+        self.vehicles = None
+        self.fleet = None
+        self.paths = None
+        # Indices of the vehicles in the update cycle, in the order they are updated.
+        self.order = None
+        # Flags the vehicles that remain in the update cycle.
+        self.in_cycle = None
+        # Position of each vehicle in the update cycle, see SimulatorEngine.update_order
+        self.sequence = None
+
+        # Dictionary where the key is the value of a state and the value the function
+        # associated with that state. Each function receives the index of a vehicle.
+        self.next_function = {States.AT_DEST.value: self.at_destination,
+                              States.TOWARDS_DEST.value: self.towards_destination,
+                              States.TOWARDS_ST.value: self.towards_station,
+                              States.CHARGING.value: self.charging,
+                              States.NO_BATTERY.value: self.no_battery}
+
+    def restart(self):
+        self.vehicles = self.simulation.vehicles
+        if self.fleet is None:
+            self.fleet = Fleet(self.vehicles, self.simulation.ev_vehicles)
+        else:
+            self.fleet.restart()
+
+        self.paths = [[] for _ in self.vehicles]
+        self.order = np.empty(0, dtype="int32")
+        self.in_cycle = np.zeros(self.fleet.size, dtype=bool)
+        super().restart()
+
+    def restart_update_order(self):
+        """Initially every vehicle is waiting at a destination, in the order
+        of the list of vehicles."""
+        self.sequence = np.arange(self.fleet.size, dtype="int64")
+        self.last_update_order = self.fleet.size
+        for i in range(self.fleet.size):
+            self.wait(i, int(self.fleet.wait_time[i]))
+
+    def add_to_update_order(self, i):
+        """Places the vehicle i at the end of the update cycle."""
+        self.last_update_order += 1
+        self.sequence[i] = self.last_update_order
+
+    def wait(self, i, wait_time):
+        """The vehicle i leaves the update cycle until wait_time steps have passed."""
+        self.fleet.wait_time[i] = wait_time
+        self.in_cycle[i] = False
+        self.idle_vehicles.schedule(i, self.sequence[i], wait_time)
+
+    def fill_snapshot(self, state, cell):
+        np.copyto(state, self.fleet.state)
+        np.copyto(cell, self.fleet.cell)
+
+    def set_state(self, i, state):
+        """Sets the state of the vehicle i in the fleet and in the Vehicle object."""
+        self.fleet.state[i] = state.value
+        self.vehicles[i].state = state
+
+    def compute_routes(self):
+        """Computes the paths requested in this step in a single batch."""
+        if not self.route_requests:
+            return
+        paths = self.astar.new_paths([self.fleet.cell[i] for (i, _) in self.route_requests],
+                                     [target.id for (_, target) in self.route_requests])
+        for (i, _), path in zip(self.route_requests, paths):
+            self.paths[i] = path
+        self.route_requests = []
+
+    def towards_destination(self, i):
+        """Function called when the vehicle i has State.TOWARDS_DEST."""
+        fleet = self.fleet
+        electric = fleet.electric[i]
+
+        if self.compute_next_position(i, self.city_cells[fleet.destination[i]]):
+            # If we have reached the destination, set the position as a free position
+            self.new_releases.append(self.city_cells[fleet.cell[i]])
+
+            # set the vehicles' state to at destination
+            self.set_state(i, States.AT_DEST)
+            # the vehicle stays idle at the destination, out of the update cycle
+            self.wait(i, self.compute_idle())
+
+        elif electric:
+            if fleet.battery[i] <= self.simulation.BATTERY_LOWER:
+                # The vehicle is running out of battery and needs to recharge
+                self.set_state(i, States.TOWARDS_ST)
+                station = self.choose_station(fleet.cell[i])
+                fleet.station[i] = self.stations_index[station]
+                self.paths[i] = []  # The path to the destination is computed again after charging
+                fleet.recompute_path[i] = False
+                fleet.seeking[i] = 0  # Start the seeking counter
+
+            elif fleet.battery[i] == 0:
+                # The vehicle has run out of battery
+                self.set_state(i, States.NO_BATTERY)
+
+    def no_battery(self, i):
+        """Makes the vehicle i invisible to the traffic and removes it from
+        the update cycle."""
+        self.new_releases.append(self.city_cells[self.fleet.cell[i]])
+        self.in_cycle[i] = False
+
+    def at_destination(self, i):
+        """Function called when the idle time of vehicle i at its destination
+        is over."""
+        self.set_state(i, States.TOWARDS_DEST)
+        destination = self.rng.routing_sampler.choice(self.city_cells)
+        self.fleet.destination[i] = destination.id
+        self.request_route(i, destination)
+
+    def towards_station(self, i):
+        """Function called when the vehicle i has State.TOWARDS_ST."""
+        fleet = self.fleet
+        fleet.seeking[i] += 1
+        station = self.simulation.stations[fleet.station[i]]
+
+        if self.compute_next_position_to_station(i, station):
+            # Free up the position
+            self.new_releases.append(self.city_cells[fleet.cell[i]])
+
+            # Store the seeking time
+            self.seeking_history[self.vehicles[i].id].append(int(fleet.seeking[i]))
+            self.set_state(i, States.QUEUEING)
+
+            # Join the queue of the station and leave the update cycle.
+            station.enqueue(i, self.tstep)
+            self.dirty_stations.add(int(fleet.station[i]))
+            self.in_cycle[i] = False
+
+        elif fleet.battery[i] == 0:
+            # The vehicle has run out of battery
+            self.set_state(i, States.NO_BATTERY)
+
+    def update_at_station(self, station):
+        """Update the vehicles that are inside the station queueing"""
+
+        if len(station.queue):
+            # Assign a new charger to the first vehicle in the queue
+            if station.charger_available():
+                i, self.fleet.queueing[i] = station.dequeue(self.tstep)  # Retrieve the first vehicle.
+                self.queueing_history[self.vehicles[i].id].append(int(self.fleet.queueing[i]))
+
+                self.set_state(i, States.CHARGING)
+                goal_charge = self.compute_battery()  # Compute the goal charge and wait time.
+                wait_time = int(self.simulation.units.steps_to_recharge(goal_charge - self.fleet.battery[i]))
+                self.fleet.battery[i] = goal_charge
+
+                # The vehicle returns to the end of the update cycle once it is charged.
+                self.add_to_update_order(i)
+                self.wait(i, wait_time)
+
+    def charging(self, i):
+        """Function called when the vehicle i has finished charging."""
+        station = self.simulation.stations[self.fleet.station[i]]
+        station.vehicle_leaving()
+        self.dirty_stations.add(int(self.fleet.station[i]))
+        self.fleet.station[i] = -1
+        self.set_state(i, States.TOWARDS_DEST)
+
+        self.request_route(i, self.city_cells[self.fleet.destination[i]])
+
+    def compute_next_position(self, i, target):
+        """Moves the vehicle i one step along its path towards the target. Returns
+        True if the vehicle is at the target after the movement."""
+        fleet = self.fleet
+        cell = self.city_cells[fleet.cell[i]]
+
+        # Recompute the path if we have diverted from the path in the previous step.
+        if fleet.recompute_path[i]:
+            self.paths[i] = self.astar.recompute_path(self.paths[i], cell, target)
+            fleet.recompute_path[i] = False
+
+        path = self.paths[i]
+        next_cell = path.pop(-1)
+        choice = self.move(i, cell, next_cell)
+
+        if choice is None:
+            path.append(next_cell)  # restore the path
+        else:
+            fleet.recompute_path[i] = choice is not next_cell
+            cell = choice
+
+        return cell is target
+
+    def compute_next_position_to_station(self, i, station):
+        """Moves the vehicle i one step towards the station following the
+        shortest paths to the station. Returns True if the vehicle is at the
+        station after the movement."""
+        cell = self.city_cells[self.fleet.cell[i]]
+        if cell is not station.cell:
+            next_cell = self.city_cells[self.station_fields[self.fleet.station[i], cell.id]]
+            cell = self.move(i, cell, next_cell) or cell
+
+        return cell is station.cell
+
+    def move(self, i, cell, next_cell):
+        """Tries to move the vehicle i from cell to next_cell applying the traffic
+        rules. Returns the cell the vehicle has moved to or None if it can't move."""
+        choice = self.resolve_movement(cell, next_cell)
+        if choice is not None:
+            self.new_releases.append(cell)
+            self.new_occupations.append(choice)
+            self.fleet.cell[i] = choice.id
+            self.vehicles[i].cell = choice
+            if self.fleet.electric[i]:
+                self.fleet.battery[i] -= 1
+
+        return choice
+
+    def update_city_state(self):
+        """Based on the cells marked by the vehicles, update the state of the
+        city and remove from the update cycle the vehicles that left it."""
+        self.apply_occupations()
+        self.order = self.order[self.in_cycle[self.order]]
+
+    def next_step(self):
+        """Computes the next step of the fleet. The vehicles are visited in
+        the same order as in SimulatorEngine.next_step()"""
+        self.tstep += 1
+        fleet = self.fleet
+        moving = (States.TOWARDS_DEST.value, States.TOWARDS_ST.value)
+
+        # Advance only the vehicles in the avenues
+        in_avenue = np.isin(fleet.state[self.order], moving) & self.fast_cells[fleet.cell[self.order]]
+        for i in self.order[in_avenue].tolist():
+            self.next_function[fleet.state[i]](i)
+        # Update the city state
+        self.update_city_state()
+
+        # Insert the vehicles whose waiting is over in the update cycle
+        woken = self.idle_vehicles.advance()
+        if woken:
+            woken = np.array(woken, dtype="int32")
+            self.in_cycle[woken] = True
+            self.order = np.insert(self.order, np.searchsorted(self.sequence[self.order], self.sequence[woken]), woken)
+
+        # Now advance all the vehicles in the update cycle
+        for i in self.order.tolist():
+            self.next_function[fleet.state[i]](i)
+
+        self.update_stations()
+        self.compute_routes()
+
+        # Set the current city state to the new one
+        self.update_city_state()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+
+from src.simulator.cythonGraphFunctions import contract_graph, reverse_dijkstra
+
+
+def next_hop_dtype(n_cells):
+    """Returns the smallest unsigned type that can store the id of every cell
+    and the value used for "no next hop", which is the maximum of the type."""
+    return np.dtype("uint16") if n_cells < np.iinfo("uint16").max else np.dtype("uint32")
+
+
+def build_next_hop_table(graph, filename):
+    """Computes the next hop table of the graph and stores it as a .npy file.
+    The entry table[goal, cell] is the next cell from cell in a shortest path
+    to goal, the maximum value of the type when there is none.
+
+    The table is written row by row to a temporary file that is renamed at the
+    end, so processes that build the same table at the same time don't see a
+    partial file.
+
+    :param graph: a CityGraph.
+    :param filename: path of the .npy file.
+    """
+    dtype = next_hop_dtype(graph.n_cells)
+    temporary = "{}.{}.tmp".format(filename, os.getpid())
+    table = np.lib.format.open_memmap(temporary, mode="w+", dtype=dtype, shape=(graph.n_cells, graph.n_cells))
+
+    no_hop = np.iinfo(dtype).max
+    for goal in range(graph.n_cells):
+        next_hop = reverse_dijkstra(graph, goal)[1]
+        table[goal] = np.where(next_hop < 0, no_hop, next_hop)
+
+    table.flush()
+    del table
+    os.replace(temporary, filename)
+
+
+def load_next_hop_table(graph, filename):
+    """Returns the next hop table of the graph memory mapped in read only mode,
+    so every process that uses it shares the same pages. The table is built
+    when the file doesn't exist."""
+    make_directory(filename)
+    if not os.path.exists(filename):
+        build_next_hop_table(graph, filename)
+
+    table = np.load(filename, mmap_mode="r")
+    if table.shape != (graph.n_cells, graph.n_cells) or table.dtype != next_hop_dtype(graph.n_cells):
+        raise ValueError("The next hop table {} doesn't belong to this city".format(filename))
+    return table
+
+
+def build_contraction_hierarchy(graph, filename):
+    """Computes the contraction hierarchy of the graph and stores its arrays
+    in a .npz file, see cythonGraphFunctions.contract_graph().
+
+    :param graph: a CityGraph.
+    :param filename: path of the .npz file.
+    """
+    hierarchy = contract_graph(graph)
+    temporary = "{}.{}.tmp".format(filename, os.getpid())
+    with open(temporary, "wb") as f:
+        np.savez(f, **hierarchy)
+    os.replace(temporary, filename)
+    return hierarchy
+
+
+def load_contraction_hierarchy(graph, filename):
+    """Returns the contraction hierarchy of the graph stored in the file, which
+    is built when it doesn't exist. """
+    make_directory(filename)
+    if not os.path.exists(filename):
+        return build_contraction_hierarchy(graph, filename)
+
+    with np.load(filename) as f:
+        hierarchy = {key: f[key] for key in f.files}
+    if hierarchy["rank"].shape != (graph.n_cells,):
+        raise ValueError("The contraction hierarchy {} doesn't belong to this city".format(filename))
+    return hierarchy
+
+
+def make_directory(filename):
+    """Creates the directory of the file if it doesn't exist."""
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
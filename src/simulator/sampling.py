@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class TruncatedNormalSampler(object):
+    def __init__(self, mean, std, lower, upper, block_size=1024, generator=np.random):
+        """Draws integers from a normal distribution truncated to [lower, upper].
+        Each value is a normal value truncated to an integer, values out of the
+        bounds are rejected. The values are drawn in blocks and kept in a buffer,
+        so the random generator is called once per block. The buffer is a list
+        because reading a list item is much cheaper than reading an array item.
+
+        :param generator: object with the method normal(loc, scale, size), the
+        numpy.random module or a numpy.random.Generator.
+        """
+        super().__init__()
+        if lower > upper:
+            raise ValueError("Empty interval [{}, {}]".format(lower, upper))
+        self.mean = mean
+        self.std = std
+        self.lower = lower
+        self.upper = upper
+        self.block_size = block_size
+        self.generator = generator
+
+        # The next value returned is buffer[index]
+        self.buffer = []
+        self.index = 0
+
+    def __call__(self):
+        """Returns the next value."""
+        if self.index == len(self.buffer):
+            self.refill(self.block_size)
+        self.index += 1
+        return self.buffer[self.index - 1]
+
+    def sample(self, n):
+        """Returns an array with the next n values."""
+        if len(self.buffer) - self.index < n:
+            self.refill(max(n, self.block_size))
+        self.index += n
+        return np.array(self.buffer[self.index - n:self.index], dtype="int64")
+
+    def refill(self, n):
+        """Draws values until the buffer has at least n values left. The values
+        not returned yet are kept at the start of the buffer."""
+        buffer = self.buffer[self.index:]
+        while len(buffer) < n:
+            values = self.generator.normal(self.mean, self.std, self.block_size).astype("int64")
+            buffer.extend(values[(values >= self.lower) & (values <= self.upper)].tolist())
+        self.buffer = buffer
+        self.index = 0
+
+    def restart(self):
+        """Discards the values in the buffer."""
+        self.buffer = []
+        self.index = 0
+
+
+class UniformSampler(object):
+    def __init__(self, generator, block_size=1024):
+        """Draws uniform values in [0, 1) in blocks, like TruncatedNormalSampler.
+
+        :param generator: a numpy.random.Generator.
+        """
+        super().__init__()
+        self.generator = generator
+        self.block_size = block_size
+        self.buffer = []
+        self.index = 0
+
+    def __call__(self):
+        """Returns the next value."""
+        if self.index == len(self.buffer):
+            self.buffer = self.generator.random(self.block_size).tolist()
+            self.index = 0
+        self.index += 1
+        return self.buffer[self.index - 1]
+
+    def choice(self, sequence):
+        """Returns a random item of the non empty sequence."""
+        return sequence[int(self() * len(sequence))]
+
+    def restart(self):
+        """Discards the values in the buffer."""
+        self.buffer = []
+        self.index = 0
+
+
+class RandomStreams(object):
+    # Independent streams of random numbers: the placement of the vehicles, the
+    # choice of destinations and stations, the lane changes, the idle times and
+    # the goal charges.
+    STREAMS = ("placement", "routing", "lanes", "idle", "battery")
+
+    def __init__(self, seed):
+        """Random numbers of a simulation. Each stream is a numpy.random.Generator
+        whose state is derived from the seed and the repetition, so a repetition
+        gives the same results whatever the repetitions run before it, and the
+        streams don't change when another stream draws more or less values.
+
+        The generators are attributes named after the streams. The routing and
+        lanes streams are also read through the UniformSampler objects
+        routing_sampler and lanes_sampler.
+
+        :param seed: non negative integer.
+        """
+        super().__init__()
+        self.seed = seed
+        for name in self.STREAMS:
+            setattr(self, name, np.random.Generator(np.random.PCG64()))
+        self.routing_sampler = UniformSampler(self.routing)
+        self.lanes_sampler = UniformSampler(self.lanes)
+        self.restart()
+
+    def restart(self, repetition=None):
+        """Sets the streams to their state at the start of the repetition, or
+        to the state used to set up the simulation when repetition is None."""
+        key = 0 if repetition is None else repetition + 1
+        children = np.random.SeedSequence(self.seed, spawn_key=(key,)).spawn(len(self.STREAMS))
+        for name, child in zip(self.STREAMS, children):
+            getattr(self, name).bit_generator.state = np.random.PCG64(child).state
+        self.routing_sampler.restart()
+        self.lanes_sampler.restart()
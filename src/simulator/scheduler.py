@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+
+class TimingWheel(object):
+    def __init__(self, n_slots):
+        """Schedules items to be woken up after a number of steps. The wheel
+        has a slot for each of the next steps, an item that has to wait
+        d steps is stored in the slot of the step current + d, so scheduling
+        and waking up an item are O(1).
+
+        :param n_slots: initial number of slots, the longest delay that fits in
+        the wheel is n_slots - 1. The wheel grows when a longer delay is scheduled.
+        """
+        super().__init__()
+        self.slots = [[] for _ in range(max(n_slots, 2))]
+        self.current = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def restart(self):
+        """Removes every item and sets the current step to zero."""
+        self.slots = [[] for _ in self.slots]
+        self.current = 0
+        self.size = 0
+
+    def schedule(self, item, key, delay):
+        """Wakes up the item after delay steps. Items with a delay lower than
+        one are never woken up, so they are not stored.
+
+        :param key: unique value used to sort the items woken up in the same step.
+        """
+        if delay < 1:
+            return
+        if delay >= len(self.slots):
+            self.resize(2 * delay)
+
+        self.slots[(self.current + delay) % len(self.slots)].append((key, item))
+        self.size += 1
+
+    def advance(self):
+        """Moves the wheel one step forward and returns the list of items whose
+        waiting time is over, sorted by their key."""
+        self.current += 1
+        index = self.current % len(self.slots)
+        slot = self.slots[index]
+        if not slot:
+            return []
+
+        self.slots[index] = []
+        self.size -= len(slot)
+        slot.sort(key=lambda entry: entry[0])
+        return [item for (key, item) in slot]
+
+    def resize(self, n_slots):
+        """Moves the items to a wheel with n_slots slots."""
+        old_slots, n = self.slots, len(self.slots)
+        self.slots = [[] for _ in range(n_slots)]
+        for index, slot in enumerate(old_slots):
+            # Every delay in the old wheel is between 1 and n-1
+            wake_up = self.current + (index - self.current) % n
+            self.slots[wake_up % n_slots].extend(slot)
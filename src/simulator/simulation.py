@@ -1,21 +1,25 @@
 # -*- coding: utf-8 -*-
 import os
-import random
 import time
+import zlib
 
 import h5py
+import numpy as np
 
-from src.metrics.metrics import SimulationMetric, SimulationSnapshot
+from src.metrics.metrics import SimulationMetric, SnapshotRing
 from src.metrics.units import Units
+from src.metrics.writers import BackgroundWriter, StreamWriter
 from src.models.station import Station
 from src.models.vehicle import ElectricVehicle, Vehicle
+from src.simulator.city_cache import load_city, load_stations_placement
 from src.simulator.engine import SimulatorEngine
+from src.simulator.sampling import RandomStreams
 
 # from src.graphlib.pygraphFunctions import Graph
 
 
 class Simulation():
-    def __init__(self, EV_DEN, TF_DEN, ST_LAYOUT, PATHNAME):
+    def __init__(self, EV_DEN, TF_DEN, ST_LAYOUT, PATHNAME, SEED=None):
         """Creates a Simulation object receiving:
 
         :param TF_DEN: traffic density of the simulation, it is expressed
@@ -28,6 +32,11 @@ class Simulation():
         :param ST_LAYOUT: is the layout of the stations, can either be
         'distributed', 'central' or 'four'.
 
+        :param SEED: seed of the random numbers of the simulation, see
+        sampling.RandomStreams. By default it is computed from EV_DEN, TF_DEN
+        and ST_LAYOUT, so each simulation has its own random numbers and running
+        it again gives the same results.
+
         In order for the simulation to work, once the Simulation object
         is created, the following methods must be called:
 
@@ -49,6 +58,10 @@ class Simulation():
         self.sim_name = "EV_DEN: {} TF_DEN: {} LAYOUT: {}".format(EV_DEN, TF_DEN, ST_LAYOUT)
         self.filename = PATHNAME + "/results/{}#{}#{}".format(
             self.EV_DEN, self.TF_DEN, self.ST_LAYOUT)
+        if SEED is None:
+            SEED = zlib.crc32("{}#{}#{}".format(EV_DEN, TF_DEN, ST_LAYOUT).encode())
+        self.SEED = np.uint32(SEED)
+        self.rng = RandomStreams(int(self.SEED))
         # Attributes filled in the method set_simulation_units()
         self.units = None
 
@@ -60,6 +73,7 @@ class Simulation():
         self.INTERSEC_LENGTH = None
         self.city_map = None
         self.city_matrix = None
+        self.graph = None
 
         self.avenues = None
         self.SIZE = None
@@ -70,6 +84,7 @@ class Simulation():
         self.TOTAL_PLUGS = None  # Total number of plugs in the city
         self.TOTAL_D_ST = None  # Total number of distributed stations
         self.stations = None
+        self.station_districts = None
         self.stations_map = None
 
     def set_simulation_units(self, speed=10, cell_length=5, simulation_speed=1, battery=24, cs_power=7, autonomy=135):
@@ -84,20 +99,30 @@ class Simulation():
         self.CS_POWER = cs_power
         self.AUTONOMY = autonomy
 
-    def create_city(self, Builder, RB_LENGTH=6, AV_LENGTH=4*5, SCALE=1, INTERSEC_LENGTH=3):
-        """Builder is a CityBuilder class"""
+    def create_city(self, Builder, RB_LENGTH=6, AV_LENGTH=4*5, SCALE=1, INTERSEC_LENGTH=3, cache=False):
+        """Builder is a CityBuilder class
+
+        :param cache: if True the city is read from PATHNAME/cache, where it is
+        stored the first time it is created, so the simulations of the same city
+        don't build it again.
+        """
+        self.SCALE = SCALE
+        self.AV_LENGTH = AV_LENGTH
+        self.RB_LENGTH = RB_LENGTH
+        self.INTERSEC_LENGTH = INTERSEC_LENGTH
 
         # Create the city builder
-        self.city_builder = Builder(RB_LENGTH, AV_LENGTH, SCALE, INTERSEC_LENGTH)
+        if cache:
+            self.city_builder = load_city(Builder, self.city_cache_filename("city", "npz"),
+                                          RB_LENGTH, AV_LENGTH, SCALE, INTERSEC_LENGTH)
+        else:
+            self.city_builder = Builder(RB_LENGTH, AV_LENGTH, SCALE, INTERSEC_LENGTH)
         self.city_map = self.city_builder.city_map
         self.city_matrix = self.city_builder.city_matrix
+        self.graph = self.city_builder.graph
 
         self.avenues = self.city_builder.avenues
         self.roundabouts = self.city_builder.roundabouts
-        self.SCALE = SCALE
-        self.AV_LENGTH = AV_LENGTH
-        self.RB_LENGTH = RB_LENGTH
-        self.INTERSEC_LENGTH = INTERSEC_LENGTH
 
         self.SIZE = self.city_builder.SIZE
         self.STR_RATE = self.city_builder.STR_RATE
@@ -105,7 +130,7 @@ class Simulation():
         # Create the city districts
         self.districts = self.city_builder.create_districts(self.ST_LAYOUT)
 
-    def stations_placement(self, min_plugs_per_station, min_num_stations):
+    def stations_placement(self, min_plugs_per_station, min_num_stations, cache=False, influence="lattice"):
         """This method computes the number total number of distributed stations
         that are needed in order to make the city symmetrical and compatible 
         between different stations layour, for example the total number of distributed stations
@@ -117,6 +142,10 @@ class Simulation():
         want each distrbuted station to have.
         :param min_num_stations: is the minimum number of distributed stations
         that we want to have in a simulation with the ST_LAYOUT = "distributed"
+        :param cache: if True the placement is read from PATHNAME/cache, like
+        the city in create_city().
+        :param influence: how the area served by each cluster of stations is
+        computed, "lattice" or "network" (see SquareCity.place_stations_new)
         """
 
         # Compute the amount of plugs and the number of distributed stations
@@ -126,7 +155,13 @@ class Simulation():
         # Place the stations around the city based on the layout
         # self.stations_pos = self.city_builder.place_stations(self.ST_LAYOUT, self.districts, self.TOTAL_D_ST)
         
-        self.stations_clusters, self.pos_clusters = self.city_builder.place_stations_new(self.ST_LAYOUT, self.TOTAL_D_ST)
+        if cache:
+            self.stations_clusters, self.pos_clusters = load_stations_placement(
+                self.city_builder, self.ST_LAYOUT, self.TOTAL_D_ST,
+                self.city_cache_filename("stations", "npz", self.ST_LAYOUT, min_num_stations, influence), influence)
+        else:
+            self.stations_clusters, self.pos_clusters = self.city_builder.place_stations_new(
+                self.ST_LAYOUT, self.TOTAL_D_ST, influence)
         # Based on the layout, compute the number of plugs that each station will have.
         
         plugs_per_station = min_plugs_per_station
@@ -136,7 +171,8 @@ class Simulation():
             plugs_per_station = self.TOTAL_PLUGS/4
 
         # Create the stations and the stations map
-        self.stations, self.stations_map = self.create_stations(self.stations_clusters, self.pos_clusters, plugs_per_station)
+        self.stations, self.station_districts, self.stations_map = self.create_stations(
+            self.stations_clusters, self.pos_clusters, plugs_per_station)
 
     def create_stations(self, stations_clusters, pos_clusters, plugs_per_station):
         """
@@ -147,21 +183,32 @@ class Simulation():
         belongs to the stations cluster with the same index.
 
         :param plugs_per_station: is the number of plugs that a station can have.
+
+        Returns a tuple (stations, station_districts, stations_map): the list of
+        stations, the list of stations of each cluster and an int32 array indexed
+        by the id of the cells with the index of the cluster that serves each cell.
          """
         stations = []
-        stations_map = {}
+        station_districts = []
+        stations_map = np.full(self.graph.n_cells, -1, dtype="int32")
 
-        for stations_pos, influence_area in zip(stations_clusters,pos_clusters):
+        for k, (stations_pos, influence_area) in enumerate(zip(stations_clusters,pos_clusters)):
             # For each position in the station cluster, create a proper Station object
             district_stations = [Station(self.city_map[pos], plugs_per_station) for pos in stations_pos]
+            station_districts.append(district_stations)
             # For each position in the influence area of this cluster, link them in the stations map
-            for influence_pos in influence_area:
-                stations_map[influence_pos] = district_stations
+            if influence_area:
+                stations_map[self.graph.id_matrix[tuple(np.array(influence_area).T)]] = k
             # Add the stations to the list of stations.
             stations.extend(district_stations)
 
+        # A cell without cluster would take the stations of the last cluster.
+        unserved = np.flatnonzero(stations_map < 0)
+        if len(unserved):
+            raise ValueError("The cell {} isn't served by any cluster of stations".format(
+                tuple(self.graph.positions[unserved[0]].tolist())))
 
-        return stations, stations_map
+        return stations, station_districts, stations_map
 
     def set_battery_distribution(self, lower, std):
         """This method sets the parameters of the normal distribution used
@@ -213,28 +260,48 @@ class Simulation():
         # Initially all the vehicles are in a AT_DEST
         # state and so they don't occupy a place.
         city_cells = list(self.city_map.values())
-        
-        random.shuffle(city_cells)
+        city_cells = [city_cells[i] for i in self.rng.placement.permutation(len(city_cells)).tolist()]
+
+        # Draw the idle times and the charges of every vehicle at once.
+        idle_times = self.simulator.idle_sampler.sample(self.TOTAL_VEHICLES).tolist()
+        charges = self.simulator.battery_sampler.sample(self.TOTAL_EV).tolist()
 
         ev_vehicles = set()
         vehicles = []
-        for _ in range(self.TOTAL_EV):
-            v = ElectricVehicle(city_cells.pop(),
-                                self.simulator.compute_idle(), self.simulator.compute_battery())
+        for i in range(self.TOTAL_EV):
+            v = ElectricVehicle(city_cells.pop(), idle_times[i], charges[i])
             vehicles.append(v)
             ev_vehicles.add(v)
-        for _ in range(self.TOTAL_VEHICLES-self.TOTAL_EV):
-            v = Vehicle(city_cells.pop(), self.simulator.compute_idle())
+        for i in range(self.TOTAL_EV, self.TOTAL_VEHICLES):
+            v = Vehicle(city_cells.pop(), idle_times[i])
             vehicles.append(v)
 
         self.vehicles = vehicles
         self.ev_vehicles = ev_vehicles
 
-    def create_simulator(self):
-        """Creates the simulator object.
-        Then it also creates the vehicles calling Simulation.create_vehicles() """
-        self.simulator = SimulatorEngine(self)
+    def create_simulator(self, Engine=SimulatorEngine, router="astar"):
+        """Creates the simulator object, Engine is a SimulatorEngine class.
+        Then it also creates the vehicles calling Simulation.create_vehicles()
+
+        :param router: algorithm used to compute the paths of the vehicles:
+        "astar" searches each path, "table" reads them from a next hop table of
+        the city and "contraction" searches them over a contraction hierarchy.
+        The table and the hierarchy are stored in PATHNAME/cache and shared by
+        every simulation of the same city. The size of the table grows with the
+        square of the number of cells, so it is meant for small and medium cities
+        while the hierarchy suits the large ones.
+        """
+        self.simulator = Engine(self, router)
         self.create_vehicles()
+        # Snapshots of the vehicles used to measure their speed
+        self.snapshots = SnapshotRing(len(self.vehicles), self.graph.positions, self.SIZE)
+
+    def city_cache_filename(self, name, extension, *keys):
+        """Returns the file in the cache folder where the data called name of
+        this city is stored. The keys are added to the name of the file."""
+        return self.PATHNAME + "/cache/{}.{}".format(
+            "#".join(str(k) for k in (name, self.RB_LENGTH, self.AV_LENGTH, self.SCALE, self.INTERSEC_LENGTH) + keys),
+            extension)
 
     def print_summary(self):
         msg = """*******************************************************\
@@ -320,46 +387,60 @@ class Simulation():
         self.print_summary()
 
         elapsed = time.time()
-        for i in range(repetitions):
-            self.repetition = i
-
-            # Restart the cells, vehicles, stations and the simulator
-            for cell in self.city_map.values():
-                cell.occupied = False
-            for v in self.vehicles:
-                v.restart()
-
-            for st in self.stations:
-                st.restart()
-
-            self.simulator.restart()
-
-            # Create a metrics object and initilize it
-            metrics = SimulationMetric(
-                self.city_map, self.stations, 3, total_tsteps, delta_tsteps, self.SIZE)
-            metrics.initialize(
-                self.vehicles, self.ev_vehicles, self.stations)
-
-            # Run the simulation using the simulator object
-            if visual == None:
-                self.run_simulator(metrics)
-            else:
-                self.run_simulator_visual(metrics, visual)
-                
-                
-
-            # Store the data into an HDF5 file.
-            self.write_results(i, metrics)
+        # The measures are written in the HDF5 file by a thread while the
+        # simulation runs, the next repetition starts without waiting for the
+        # results of the previous one.
+        with h5py.File(self.filename + ".hdf5", "a") as f:
+            background = BackgroundWriter()
+            try:
+                for i in range(repetitions):
+                    self.repetition = i
+                    self.rng.restart(i)
+
+                    # Restart the vehicles, stations and the simulator
+                    for v in self.vehicles:
+                        v.restart()
+
+                    for st in self.stations:
+                        st.restart()
+
+                    self.simulator.restart()
+
+                    metrics = self.create_metrics(background.wrap(StreamWriter(f, "/"+str(i)+"/")))
+
+                    # Run the simulation using the simulator object
+                    if visual == None:
+                        self.run_simulator(metrics)
+                    else:
+                        self.run_simulator_visual(metrics, visual)
+
+                    # Queue the data left to be stored.
+                    metrics.close(self.simulator.seeking_history, self.simulator.queueing_history)
+            except BaseException:
+                # Stop the writes without hiding the error of the simulation.
+                background.close(raise_errors=False)
+                raise
+            # Wait for the writes and raise their errors.
+            background.close()
 
         self.ELAPSED = round((time.time() - elapsed) / repetitions, 3)
 
         self.write_header_attr()
 
+    def create_metrics(self, writer=None):
+        """Creates a metrics object for a repetition and initializes it with
+        the state of the simulation. See SimulationMetric for the writer."""
+        metrics = SimulationMetric(
+            self.city_map, self.stations, 3, self.TOTAL_TSTEPS, self.DELTA_TSTEPS, self.SIZE, writer)
+        metrics.initialize(
+            self.vehicles, self.ev_vehicles, self.stations)
+        return metrics
+
     def run_simulator(self, metrics):
         """This method controls the flow of the simulator, saving the
         data and displaying a progress message. """
 
-        previous_snapshot = SimulationSnapshot(self.vehicles)
+        previous_snapshot = self.snapshots.take(self.simulator)
 
         for current_tstep in range(1, self.TOTAL_TSTEPS+1):
             
@@ -368,7 +449,7 @@ class Simulation():
 
             # Check if we have to update the data collection
             if current_tstep % self.DELTA_TSTEPS == 0:
-                current_snapshot = SimulationSnapshot(self.vehicles)
+                current_snapshot = self.snapshots.take(self.simulator)
                 metrics.update_data(self.vehicles, self.ev_vehicles, self.stations,
                                     current_snapshot, previous_snapshot, current_tstep)
                 previous_snapshot = current_snapshot
@@ -382,7 +463,7 @@ class Simulation():
         data and displaying a progress message. """
 
         
-        self.previous_snapshot = SimulationSnapshot(self.vehicles)
+        self.previous_snapshot = self.snapshots.take(self.simulator)
         def next_frame():
 
             # Compute next step of the simulation
@@ -392,7 +473,7 @@ class Simulation():
             current_tstep = visual.current_tstep
             # Check if we have to update the data collection
             if current_tstep % self.DELTA_TSTEPS == 0:
-                current_snapshot = SimulationSnapshot(self.vehicles)
+                current_snapshot = self.snapshots.take(self.simulator)
                 metrics.update_data(self.vehicles, self.ev_vehicles, self.stations, current_snapshot, self.previous_snapshot, current_tstep)
                 self.previous_snapshot = current_snapshot
 
@@ -446,9 +527,9 @@ class Simulation():
 
         if current_tstep == 0:
             print("Starting")
-            # Restart the cells, vehicles, stations and the simulator
-            for cell in self.city_map.values():
-                cell.occupied = False
+            self.rng.restart(current_repetition)
+
+            # Restart the vehicles, stations and the simulator
             for v in self.vehicles:
                 v.restart()
 
@@ -459,12 +540,11 @@ class Simulation():
             self.repetition = current_repetition
 
             # Create a metrics object and initilize it
-            current_metrics = SimulationMetric(self.city_map, self.stations, 3, self.TOTAL_TSTEPS, self.DELTA_TSTEPS, self.SIZE)
-            current_metrics.initialize(self.vehicles, self.ev_vehicles, self.stations)
+            current_metrics = self.create_metrics()
             self.metrics = current_metrics
 
             # Create the first snapshot
-            previous_snapshot = SimulationSnapshot(self.vehicles)
+            previous_snapshot = self.snapshots.take(self.simulator)
             
             current_tstep += 1
 
@@ -492,7 +572,7 @@ class Simulation():
             
             # Check if we have to update the data collection
             if current_tstep % self.DELTA_TSTEPS == 0:
-                current_snapshot = SimulationSnapshot(self.vehicles)
+                current_snapshot = self.snapshots.take(self.simulator)
                 current_metrics.update_data(self.vehicles, self.ev_vehicles, self.stations, current_snapshot, previous_snapshot, current_tstep)
                 previous_snapshot = current_snapshot
 
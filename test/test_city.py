@@ -2,6 +2,8 @@ import unittest
 import src.models.cities as cities
 import random
 
+import numpy as np
+
 class TestCityBuilder(unittest.TestCase):
     
 
@@ -121,6 +123,15 @@ class TestSquareCity(unittest.TestCase):
         stations, clusters = sq.place_stations_new("four", 16)
         self.assertTrue(len(stations) == len(clusters), "Number of stations cluster doesn't match the service areas.")
     
+    def test_torus_distances(self):
+        sq = cities.SquareCity(6, 7*4, 2)
+        random.seed(9)
+        positions = [(random.randrange(sq.SIZE), random.randrange(sq.SIZE)) for _ in range(30)]
+        distances = cities.torus_distances(np.array(positions[:10]), np.array(positions[10:]), sq.SIZE)
+        for i, a in enumerate(positions[:10]):
+            for j, b in enumerate(positions[10:]):
+                self.assertEqual(distances[i, j], cities.lattice_distance(*a, *b), "Wrong distance in the torus")
+
     def test_stations_coverage(self):
         sq = cities.SquareCity(6, 7*4, 2)
         cells = set(sq.city_map.keys())
@@ -129,4 +140,45 @@ class TestSquareCity(unittest.TestCase):
 
         self.assertEqual(cells,{c for c in cells for cells in clusters}, "There are cells that are not covered by any station.")
 
-   
\ No newline at end of file
+    def test_network_influence(self):
+        sq = cities.SquareCity(6, 7*4, 2)
+        stations, clusters = sq.place_stations_new("distributed", 16, influence="network")
+        self.assertEqual(stations, sq.place_stations_new("distributed", 16)[0], "The stations depend on the influence areas")
+        self.assertEqual(sorted(p for cluster in clusters for p in cluster), sorted(sq.city_map.keys()),
+                         "The influence areas are not a partition of the city")
+        for st_cluster, cluster in zip(stations, clusters):
+            self.assertTrue(set(st_cluster) <= set(cluster), "A station is not served by its own cluster")
+        with self.assertRaises(ValueError):
+            sq.place_stations_new("distributed", 16, influence="euclidean")
+
+   
+class TestCityGraph(unittest.TestCase):
+
+    def test_ids(self):
+        sq = cities.SquareCity(6, 7*4, 2)
+        graph = sq.graph
+        self.assertEqual([c.id for c in sq.city_map.values()], list(range(graph.n_cells)), "The ids don't follow the city map")
+        self.assertEqual([tuple(p) for p in graph.positions.tolist()], sorted(sq.city_map.keys()), "The cells are not sorted by position")
+        self.assertTrue(all(graph.id_matrix[c.pos] == c.id for c in sq.city_map.values()), "Wrong id matrix")
+        self.assertEqual(int((graph.id_matrix >= 0).sum()), int(sq.city_matrix.sum()), "Wrong id matrix")
+
+    def test_adjacency(self):
+        sq = cities.SquareCity(6, 7*4, 2)
+        graph = sq.graph
+        for cell in sq.city_map.values():
+            start, end = graph.offsets[cell.id], graph.offsets[cell.id+1]
+            self.assertEqual(graph.successors(cell.id).tolist(), [s.id for s in cell.successors], "Wrong successors")
+            self.assertEqual(graph.priority[start:end].tolist(), [int(s in cell.prio_successors) for s in cell.successors], "Wrong priority mask")
+            self.assertEqual(sorted(graph.predecessors(cell.id).tolist()), sorted(p.id for p in cell.predecessors), "Wrong predecessors")
+            self.assertEqual(graph.cell_type[cell.id], cell.cell_type, "Wrong cell type")
+
+    def test_tiling(self):
+        sq = cities.SquareCity(6, 5*4, 3)
+        base, size = sq.base_size, sq.SIZE
+        for (x, y), cell in sq.city_map.items():
+            moved = sq.city_map[((x + base) % size, (y + 2*base) % size)]
+            self.assertEqual((moved.cell_type, moved.direction), (cell.cell_type, cell.direction), "The tiles are different")
+            self.assertEqual([c.pos for c in moved.prio_successors],
+                             [((i + base) % size, (j + 2*base) % size) for (i, j) in (c.pos for c in cell.prio_successors)],
+                             "The successors are not moved with the tile")
+            self.assertEqual(len(moved.prio_predecessors), len(cell.prio_predecessors))
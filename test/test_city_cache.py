@@ -0,0 +1,44 @@
+import unittest
+
+import os
+import tempfile
+
+import numpy as np
+
+from src.models.cities import SquareCity
+from src.simulator.city_cache import load_city, load_stations_placement
+
+
+class TestCityCache(unittest.TestCase):
+
+    def test_same_city(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "cache", "city.npz")
+            built = load_city(SquareCity, filename, 6, 5*4, 2)
+            self.assertTrue(os.path.exists(filename), "The city is not stored")
+            loaded = load_city(SquareCity, filename, 6, 5*4, 2)
+
+        self.assertEqual(list(loaded.city_map), list(built.city_map), "Different cells")
+        for key in ["positions", "cell_type", "offsets", "neighbours", "priority", "id_matrix", "rev_neighbours"]:
+            self.assertTrue(np.array_equal(getattr(loaded.graph, key), getattr(built.graph, key)), "Different {}".format(key))
+        self.assertTrue(np.array_equal(loaded.city_matrix, built.city_matrix))
+        self.assertEqual((loaded.SIZE, loaded.base_size, loaded.STR_RATE), (built.SIZE, built.base_size, built.STR_RATE))
+        self.assertEqual({c.pos for c in loaded.avenues}, {c.pos for c in built.avenues})
+
+        def ids(cells):
+            return sorted(c.id for c in cells)
+
+        for a, b in zip(built.city_map.values(), loaded.city_map.values()):
+            self.assertEqual((b.direction, [c.id for c in b.successors], [c.id for c in b.prio_successors]),
+                             (a.direction, [c.id for c in a.successors], [c.id for c in a.prio_successors]))
+            self.assertEqual(ids(b.prio_predecessors), ids(a.prio_predecessors), "Different priority predecessors")
+            self.assertEqual(ids(b.predecessors), ids(a.predecessors), "Different predecessors")
+
+    def test_same_stations_placement(self):
+        city = SquareCity(6, 5*4, 2)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "stations.npz")
+            built = load_stations_placement(city, "distributed", 16, filename)
+            loaded = load_stations_placement(city, "distributed", 16, filename)
+        self.assertEqual(loaded, built, "The stored placement is different")
+        self.assertEqual(built, city.place_stations_new("distributed", 16))
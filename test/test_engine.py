@@ -0,0 +1,131 @@
+import random
+import unittest
+from unittest import mock
+
+import os
+import tempfile
+
+import numpy as np
+
+from src.metrics.writers import StreamWriter
+from src.models.cities import SquareCity
+from src.models.states import States
+from src.simulator.engine import SimulatorEngine
+from src.simulator.fleet_engine import FleetSimulatorEngine
+from src.simulator.simulation import Simulation
+
+
+def create_simulation(Engine, layout="distributed", seed=3):
+    simulation = Simulation(0.5, 0.5, layout, ".", SEED=seed)
+    simulation.set_simulation_units(speed=10, cell_length=5, simulation_speed=1, battery=1, cs_power=7, autonomy=1)
+    simulation.set_battery_distribution(lower=0.25, std=0.2)
+    simulation.set_idle_distribution(upper=2, lower=1, std=0.25)
+    simulation.create_city(SquareCity, RB_LENGTH=6, AV_LENGTH=4*5, SCALE=1)
+    simulation.stations_placement(min_plugs_per_station=2, min_num_stations=10)
+    simulation.create_simulator(Engine)
+
+    for v in simulation.vehicles:
+        v.restart()
+    for st in simulation.stations:
+        st.restart()
+    simulation.simulator.restart()
+    return simulation
+
+
+class TestFleetSimulatorEngine(unittest.TestCase):
+
+    def test_same_state_counts(self):
+        reference = create_simulation(SimulatorEngine)
+        fleet = create_simulation(FleetSimulatorEngine)
+        reference_counts = []
+        for _ in range(400):
+            reference.simulator.next_step()
+            counts = np.zeros(len(States), dtype="int64")
+            for v in reference.ev_vehicles:
+                counts[v.state.value] += 1
+            reference_counts.append(counts)
+
+        for tstep in range(400):
+            fleet.simulator.next_step()
+            self.assertEqual(fleet.simulator.fleet.count_states().tolist(), reference_counts[tstep].tolist(),
+                             "The state counts differ at step {}".format(tstep))
+
+        self.assertEqual(fleet.simulator.queueing_history, reference.simulator.queueing_history,
+                         "The queueing times differ")
+
+        visited = {States(s) for counts in reference_counts for s in np.nonzero(counts)[0]}
+        self.assertTrue({States.TOWARDS_ST, States.QUEUEING, States.CHARGING} <= visited,
+                        "The simulation doesn't go through the charging states")
+
+    def test_vehicles_in_sync(self):
+        simulation = create_simulation(FleetSimulatorEngine)
+        for _ in range(100):
+            simulation.simulator.next_step()
+        fleet = simulation.simulator.fleet
+        self.assertEqual([v.state.value for v in simulation.vehicles], fleet.state.tolist(),
+                         "The state of the vehicles is not in sync with the fleet")
+        self.assertEqual([v.cell.id for v in simulation.vehicles], fleet.cell.tolist(),
+                         "The cell of the vehicles is not in sync with the fleet")
+
+
+class TestSimulatorEngine(unittest.TestCase):
+
+    def test_blocking_cells(self):
+        simulation = create_simulation(SimulatorEngine, seed=4)
+        engine = simulation.simulator
+        for _ in range(200):
+            engine.next_step()
+
+        moving = {v.cell.id for v in simulation.vehicles if v.state in States.moving_states()}
+        self.assertTrue(set(np.flatnonzero(engine.occupied).tolist()) <= moving,
+                        "There are occupied cells without moving vehicles")
+        blocking = [engine.occupied[c.id] + sum(engine.occupied[p.id] for p in c.prio_predecessors)
+                    for c in engine.city_cells]
+        self.assertEqual(engine.blocking.tolist(), blocking, "Wrong number of blocking cells")
+
+    def test_reproducible_repetitions(self):
+        def run(simulation, repetition):
+            simulation.rng.restart(repetition)
+            for v in simulation.vehicles:
+                v.restart()
+            for st in simulation.stations:
+                st.restart()
+            simulation.simulator.restart()
+            positions = []
+            for _ in range(150):
+                simulation.simulator.next_step()
+                positions.append([v.cell.id for v in simulation.vehicles])
+            return positions
+
+        simulation = create_simulation(SimulatorEngine)
+        first = run(simulation, 0)
+        self.assertNotEqual(run(simulation, 1), first, "The repetitions have the same random numbers")
+        self.assertEqual(run(simulation, 0), first, "The repetition is not reproduced")
+        # The global random generators don't change the results.
+        other = create_simulation(SimulatorEngine)
+        random.seed(7)
+        np.random.seed(7)
+        self.assertEqual(run(other, 0), first, "The simulation is not reproduced")
+
+
+class TestSimulation(unittest.TestCase):
+
+    def test_run_errors(self):
+        """An error of the simulation is not replaced by an error of the writes."""
+        class FailingWriter(StreamWriter):
+            def flush(self):
+                raise OSError("No space left")
+
+        def run_simulator(metrics):
+            metrics.writer.flush()
+            raise ValueError("Engine error")
+
+        simulation = create_simulation(SimulatorEngine)
+        simulation.run_simulator = run_simulator
+        with tempfile.TemporaryDirectory() as directory:
+            simulation.PATHNAME = directory
+            simulation.filename = os.path.join(directory, "results", "simulation")
+            with mock.patch("src.simulator.simulation.StreamWriter", FailingWriter):
+                with self.assertRaises(ValueError) as context:
+                    simulation.run(1, 1, 1)
+        self.assertIsNone(context.exception.__context__, "The error of the writes is raised")
@@ -1,6 +1,12 @@
 import unittest
 
-from src.simulator.cythonGraphFunctions import lattice_distance, AStar
+import os
+import random
+import tempfile
+
+from src.simulator.cythonGraphFunctions import lattice_distance, AStar, ContractionRouter, GraphAStar, TableRouter, \
+    nearest_targets, reverse_dijkstra, select_landmarks
+from src.simulator.routing import load_contraction_hierarchy, load_next_hop_table
 import src.models.cities as cities
 
 
@@ -19,4 +25,238 @@ class TestAStar(unittest.TestCase):
     
     def test_path_length(self):
         sq = cities.SquareCity(6, 7*4, 2)
-    
\ No newline at end of file
+
+
+def path_cost(graph, path):
+    """Returns the cost of the path, a list of cell ids from the start to the goal."""
+    return sum(graph.cost[graph.offsets[a] + graph.successors(a).tolist().index(b)] for a, b in zip(path, path[1:]))
+
+
+def path_ids(start, path):
+    """Returns the ids of the cells from start to the goal of a path returned
+    by new_path(), which is reversed and doesn't have the start."""
+    return [start.id] + [c.id for c in path[::-1]]
+
+
+class CityTestCase(unittest.TestCase):
+    """Builds the city of the tests once for every test of the class."""
+    SCALE = 2
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sq = cities.SquareCity(6, 7*4, cls.SCALE)
+        cls.cells = list(cls.sq.city_map.values())
+        cls.graph = cls.sq.graph
+
+    def assertConnected(self, path, msg):
+        """Checks that each cell id of the path is a successor of the previous one."""
+        for a, b in zip(path, path[1:]):
+            self.assertIn(b, self.graph.successors(a).tolist(), msg)
+
+
+class TestGraphAStar(CityTestCase):
+
+    def test_same_paths(self):
+        cells = self.cells
+        astar, graph_astar = AStar(200), GraphAStar(200, self.graph, cells)
+        random.seed(1)
+        for _ in range(100):
+            start, goal = random.choice(cells), random.choice(cells)
+            self.assertEqual(graph_astar.new_path(start, goal), astar.new_path(start, goal),
+                             "Different path from {} to {}".format(start, goal))
+
+    def test_path_ids(self):
+        cells = self.cells
+        graph_astar = GraphAStar(200, self.graph, cells)
+        start, goal = cells[0], cells[-1]
+        ids = graph_astar.new_path_ids(start.id, goal.id)
+        self.assertEqual(ids[0], goal.id, "The path doesn't start with the goal")
+        self.assertConnected([start.id] + ids[::-1], "The path is not connected")
+        self.assertEqual(graph_astar.new_path(start, start), [start], "Wrong path to the same cell")
+
+
+    def test_landmarks(self):
+        graph = self.graph
+        lattice, alt = GraphAStar(200, graph, self.cells), GraphAStar(200, graph, self.cells)
+        landmarks = select_landmarks(graph, 4)
+        self.assertEqual(len(set(landmarks)), 4, "The landmarks are repeated")
+        alt.set_landmarks(graph, landmarks)
+
+        random.seed(4)
+        for _ in range(50):
+            start, goal = random.randrange(graph.n_cells), random.randrange(graph.n_cells)
+            if start == goal:
+                continue
+            self.assertEqual(path_cost(graph, [start] + alt.new_path_ids(start, goal)[::-1]),
+                             path_cost(graph, [start] + lattice.new_path_ids(start, goal)[::-1]),
+                             "The path with landmarks is not a shortest path")
+        self.assertLess(alt.total_expansions, lattice.total_expansions, "The landmarks don't reduce the expanded cells")
+
+    def test_bidirectional(self):
+        graph = self.graph
+        forward, bidirectional = GraphAStar(200, graph, self.cells), GraphAStar(200, graph, self.cells)
+        bidirectional.bidirectional = True
+
+        random.seed(6)
+        for landmarks in [[], select_landmarks(graph, 2)]:
+            if landmarks:
+                bidirectional.set_landmarks(graph, landmarks)
+            for _ in range(50):
+                start, goal = random.randrange(graph.n_cells), random.randrange(graph.n_cells)
+                path = [start] + bidirectional.new_path_ids(start, goal)[::-1]
+                self.assertEqual(path[-1], goal, "The path doesn't end at the goal")
+                self.assertConnected(path, "The path is not connected")
+                self.assertEqual(path_cost(graph, path),
+                                 path_cost(graph, [start] + forward.new_path_ids(start, goal)[::-1]),
+                                 "The bidirectional path is not a shortest path")
+        self.assertEqual(bidirectional.new_path_ids(0, 0), [0], "Wrong path to the same cell")
+
+    def test_path_cache(self):
+        cells, graph, period = self.cells, self.graph, self.sq.base_size
+        cached, fresh = GraphAStar(200, graph, cells), GraphAStar(200, graph, cells)
+        cached.set_path_cache(period, 10)
+
+        start, goal = cells[0], cells[len(cells)//3]
+        cached.new_path_ids(start.id, goal.id)
+        self.assertEqual((cached.cache_hits, cached.cache_misses), (0, 1), "The path is not stored in the cache")
+
+        # The same pair of cells moved to the next tile of the city.
+        x, y = start.pos
+        start = cells[graph.id_matrix[x, (y + period) % graph.SIZE]]
+        x, y = goal.pos
+        goal = cells[graph.id_matrix[x, (y + period) % graph.SIZE]]
+        ids = cached.new_path_ids(start.id, goal.id)
+        self.assertEqual(cached.cache_hits, 1, "The translated path is not taken from the cache")
+        self.assertEqual(ids[0], goal.id, "The translated path doesn't end at the goal")
+        path = [start.id] + ids[::-1]
+        self.assertConnected(path, "The translated path is not connected")
+        self.assertEqual(path_cost(graph, path), path_cost(graph, [start.id] + fresh.new_path_ids(start.id, goal.id)[::-1]),
+                         "The translated path is not optimal")
+
+    def test_recompute_path(self):
+        cells, graph = self.cells, self.graph
+        graph_astar = GraphAStar(200, graph, cells)
+
+        random.seed(7)
+        for _ in range(50):
+            start, goal = random.choice(cells), random.choice(cells)
+            path = graph_astar.new_path(start, goal)
+            next_cell = path.pop(-1)
+            diversions = [cells[i] for i in graph.successors(start.id) if cells[i] is not next_cell]
+            if not path or not diversions:
+                continue
+            remaining, current = list(path), random.choice(diversions)
+
+            repaired = graph_astar.recompute_path(path, current, goal)
+            self.assertConnected(path_ids(current, repaired), "The repaired path is not connected")
+            common = 0
+            while common < min(len(repaired), len(remaining)) and repaired[common] is remaining[common]:
+                common += 1
+            self.assertGreater(common, 0, "The repaired path doesn't go back to the original path")
+            self.assertEqual(repaired[0], goal, "The repaired path doesn't end at the goal")
+        self.assertGreater(graph_astar.repairs, 0)
+        self.assertEqual(graph_astar.failed_repairs, 0, "The path is computed again after a diversion")
+
+    def test_new_paths(self):
+        cells, graph = self.cells, self.graph
+        random.seed(8)
+        starts = [random.randrange(graph.n_cells) for _ in range(100)] + [3]
+        goals = [random.randrange(graph.n_cells) for _ in range(100)] + [3]
+
+        for bidirectional in [False, True]:
+            graph_astar, batch = GraphAStar(200, graph, cells), GraphAStar(200, graph, cells)
+            graph_astar.bidirectional = batch.bidirectional = bidirectional
+            batch.set_path_cache(self.sq.base_size, 200)
+            batch.set_workers(graph, 3)
+            expected = [graph_astar.new_path_ids(start, goal) for start, goal in zip(starts, goals)]
+            self.assertEqual(batch.new_paths_ids(starts, goals), expected, "The batch of paths is different")
+            self.assertEqual(batch.new_paths(starts[:5], goals[:5]),
+                             [[cells[i] for i in ids] for ids in expected[:5]])
+            self.assertEqual(batch.cache_hits, 5, "The cache is not used by the batch")
+
+
+class TestReverseDijkstra(CityTestCase):
+
+    def test_next_hop_field(self):
+        graph = self.graph
+        graph_astar = GraphAStar(200, graph, self.cells)
+
+        random.seed(2)
+        target = random.randrange(graph.n_cells)
+        dist, next_hop = reverse_dijkstra(graph, target)
+        self.assertEqual((dist[target], next_hop[target]), (0, -1))
+        for _ in range(20):
+            start = random.randrange(graph.n_cells)
+            path = [start]
+            while path[-1] != target:
+                self.assertIn(next_hop[path[-1]], graph.successors(path[-1]).tolist(), "The next hop is not a successor")
+                path.append(next_hop[path[-1]])
+            self.assertEqual(path_cost(graph, path), dist[start], "Wrong distance to the target")
+            if start != target:
+                self.assertEqual(dist[start], path_cost(graph, [start] + graph_astar.new_path_ids(start, target)[::-1]),
+                                 "The field doesn't follow a shortest path")
+
+    def test_nearest_targets(self):
+        graph = self.graph
+        random.seed(3)
+        targets = random.sample(range(graph.n_cells), 5)
+        dist, next_hop, nearest = nearest_targets(graph, targets)
+        fields = [reverse_dijkstra(graph, t)[0] for t in targets]
+        for cell in range(graph.n_cells):
+            self.assertEqual(dist[cell], min(field[cell] for field in fields), "Wrong distance to the nearest target")
+            self.assertEqual(fields[nearest[cell]][cell], dist[cell], "The nearest target is not the nearest")
+            if cell not in targets:
+                self.assertEqual(dist[cell], path_cost(graph, [cell, next_hop[cell]]) + dist[next_hop[cell]],
+                                 "The next hop doesn't follow a shortest path")
+
+
+class TestTableRouter(CityTestCase):
+    SCALE = 1
+
+    def test_same_costs(self):
+        cells, graph = self.cells, self.graph
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "cache", "next_hop.npy")
+            table = load_next_hop_table(graph, filename)
+            self.assertTrue(os.path.exists(filename), "The table is not stored")
+            self.assertEqual((table.shape, table.dtype.name), ((graph.n_cells, graph.n_cells), "uint16"))
+            router, graph_astar = TableRouter(200, table, cells), GraphAStar(200, graph, cells)
+
+            random.seed(3)
+            for _ in range(50):
+                start, goal = random.choice(cells), random.choice(cells)
+                path = router.new_path(start, goal)
+                self.assertEqual(path[0], goal, "The path doesn't end at the goal")
+                self.assertEqual(path_cost(graph, path_ids(start, path)),
+                                 path_cost(graph, path_ids(start, graph_astar.new_path(start, goal))),
+                                 "The path is not a shortest path")
+            self.assertEqual(router.new_path(cells[0], cells[0]), [cells[0]], "Wrong path to the same cell")
+            del table, router
+
+
+class TestContractionRouter(CityTestCase):
+
+    def test_same_costs(self):
+        cells, graph = self.cells, self.graph
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "contraction.npz")
+            built = load_contraction_hierarchy(graph, filename)
+            loaded = load_contraction_hierarchy(graph, filename)
+            self.assertEqual(sorted(built), sorted(loaded))
+            for key in built:
+                self.assertEqual(built[key].tolist(), loaded[key].tolist(), "The stored {} is different".format(key))
+
+        self.assertEqual(sorted(loaded["rank"].tolist()), list(range(graph.n_cells)), "Wrong order of contraction")
+        router, graph_astar = ContractionRouter(200, loaded, cells), GraphAStar(200, graph, cells)
+        random.seed(5)
+        for _ in range(100):
+            start, goal = random.choice(cells), random.choice(cells)
+            path = router.new_path(start, goal)
+            self.assertEqual(path[0], goal, "The path doesn't end at the goal")
+            self.assertConnected(path_ids(start, path), "The unpacked path is not connected")
+            self.assertEqual(path_cost(graph, path_ids(start, path)),
+                             path_cost(graph, path_ids(start, graph_astar.new_path(start, goal))),
+                             "The path is not a shortest path")
+        self.assertEqual(router.new_path(cells[0], cells[0]), [cells[0]], "Wrong path to the same cell")
@@ -0,0 +1,119 @@
+import unittest
+
+import os
+import tempfile
+
+import h5py
+import numpy as np
+
+from src.metrics.metrics import SimulationMetric, SimulationSnapshot, SnapshotRing
+from src.metrics.writers import StreamWriter
+from src.models.states import States
+from src.simulator.cythonGraphFunctions import configure_lattice_size, lattice_distance
+from src.simulator.engine import SimulatorEngine
+from src.simulator.fleet_engine import FleetSimulatorEngine
+from test.test_engine import create_simulation
+
+
+class TestSnapshotRing(unittest.TestCase):
+
+    def test_snapshots(self):
+        for Engine in (SimulatorEngine, FleetSimulatorEngine):
+            simulation = create_simulation(Engine)
+            ring = SnapshotRing(len(simulation.vehicles), simulation.graph.positions, simulation.SIZE)
+            previous = ring.take(simulation.simulator)
+            states = [v.state.value for v in simulation.vehicles]
+            for _ in range(50):
+                simulation.simulator.next_step()
+            current = ring.take(simulation.simulator)
+
+            self.assertIsNot(current, previous, "The last snapshot is overwritten")
+            self.assertEqual(previous.state.tolist(), states, "The previous snapshot has changed")
+            self.assertEqual(current.state.tolist(), [v.state.value for v in simulation.vehicles], "Wrong states")
+            self.assertEqual(list(zip(current.x_pos.tolist(), current.y_pos.tolist())),
+                             [v.cell.pos for v in simulation.vehicles], "Wrong positions")
+            self.assertIs(ring.take(simulation.simulator), previous, "The slots are not reused")
+
+
+class TestSimulationSnapshot(unittest.TestCase):
+
+    def test_mean_velocities(self):
+        size, n = 40, 300
+        generator = np.random.default_rng(4)
+        pos = generator.integers(0, size, (2, 2, n)).astype("int32")
+        states = generator.integers(0, len(States), (2, n)).astype("uint8")
+        current, previous = SimulationSnapshot(states[0], None, pos[0], size), SimulationSnapshot(states[1], None, pos[1], size)
+
+        configure_lattice_size(size, {})
+        distance = sum(lattice_distance(*pos[0, :, i].tolist(), *pos[1, :, i].tolist()) for i in range(n))
+        moving = sum(States(a) in States.moving_states() or States(b) in States.moving_states()
+                     for a, b in zip(states[0].tolist(), states[1].tolist()))
+        self.assertEqual(current.mean_velocities(previous, 2), (distance/(2*moving), distance/(2*n)))
+
+        states[:] = States.AT_DEST.value
+        self.assertEqual(current.mean_velocities(previous, 2), (0, distance/(2*n)), "Wrong speed without moving vehicles")
+
+
+class TestSimulationMetric(unittest.TestCase):
+
+    def test_heat_map(self):
+        simulation = create_simulation(FleetSimulatorEngine)
+        metrics = SimulationMetric(simulation.city_map, simulation.stations, 3, 60, 1, simulation.SIZE)
+        metrics.initialize(simulation.vehicles, simulation.ev_vehicles, simulation.stations)
+        ring = SnapshotRing(len(simulation.vehicles), simulation.graph.positions, simulation.SIZE)
+        previous = ring.take(simulation.simulator)
+        heat = np.zeros((simulation.SIZE, simulation.SIZE), dtype="int32")
+        for tstep in range(1, 61):
+            simulation.simulator.next_step()
+            current = ring.take(simulation.simulator)
+            metrics.update_data(simulation.vehicles, simulation.ev_vehicles, simulation.stations, current, previous, tstep)
+            previous = current
+            for v in simulation.vehicles:
+                if v.state in States.moving_states():
+                    heat[v.cell.pos] += 1
+
+        self.assertEqual(len(metrics.heat_map_evolution), 3)
+        self.assertTrue(heat.any())
+        self.assertTrue(np.array_equal(metrics.heat_map_matrix(metrics.heat_map_evolution[-1]), heat), "Wrong heat map")
+
+    def test_streaming(self):
+        """Writing the measures in blocks gives the same file as writing them
+        at the end, and keeps at most a block in memory."""
+        datasets = []
+        with tempfile.TemporaryDirectory() as directory:
+            for streaming in (False, True):
+                simulation = create_simulation(SimulatorEngine)
+                filename = os.path.join(directory, "{}.hdf5".format(streaming))
+                with h5py.File(filename, "w") as f:
+                    writer = StreamWriter(f, "/0/", chunk_size=8) if streaming else None
+                    metrics = SimulationMetric(simulation.city_map, simulation.stations, 3, 100, 1, simulation.SIZE,
+                                               writer, block_size=16)
+                    metrics.initialize(simulation.vehicles, simulation.ev_vehicles, simulation.stations)
+                    ring = SnapshotRing(len(simulation.vehicles), simulation.graph.positions, simulation.SIZE)
+                    previous = ring.take(simulation.simulator)
+                    for tstep in range(1, 101):
+                        simulation.simulator.next_step()
+                        current = ring.take(simulation.simulator)
+                        metrics.update_data(simulation.vehicles, simulation.ev_vehicles, simulation.stations,
+                                            current, previous, tstep)
+                        previous = current
+                        if streaming:
+                            self.assertLessEqual(len(metrics.mean_speed_evolution), 16, "The measures are kept in memory")
+                    if streaming:
+                        self.assertEqual(f["/0/velocities/speed"].shape, (96,), "The blocks are not written")
+                        self.assertEqual(metrics.heat_map_evolution, [], "The heat maps are kept in memory")
+                        metrics.close(simulation.simulator.seeking_history, simulation.simulator.queueing_history)
+                    else:
+                        metrics.write_results(f, "/0/", simulation.simulator.seeking_history,
+                                              simulation.simulator.queueing_history)
+
+                with h5py.File(filename, "r") as f:
+                    names = []
+                    f.visit(lambda name: names.append(name) if isinstance(f[name], h5py.Dataset) else None)
+                    datasets.append({name: f[name][()] for name in names})
+
+        self.assertIn("0/states/States.AT_DEST", datasets[0])
+        self.assertEqual(datasets[0]["0/states/States.AT_DEST"].shape, (101,))
+        self.assertEqual(sorted(datasets[0]), sorted(datasets[1]), "Different datasets")
+        for name, data in datasets[0].items():
+            self.assertTrue(np.array_equal(data, datasets[1][name]), "Different {}".format(name))
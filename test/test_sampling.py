@@ -0,0 +1,26 @@
+import unittest
+
+import numpy as np
+
+from src.simulator.sampling import TruncatedNormalSampler
+
+
+class TestTruncatedNormalSampler(unittest.TestCase):
+
+    def test_bounds(self):
+        sampler = TruncatedNormalSampler(50, 30, 40, 60, block_size=16, generator=np.random.RandomState(1))
+        values = [sampler() for _ in range(100)] + sampler.sample(1000).tolist()
+        self.assertTrue(all(isinstance(v, int) for v in values[:100]))
+        self.assertTrue(min(values) >= 40 and max(values) <= 60, "A value is out of the bounds")
+        self.assertAlmostEqual(np.mean(values), 50, delta=1.5)
+
+    def test_same_values(self):
+        """The values don't depend on how they are requested."""
+        a = TruncatedNormalSampler(10, 4, 5, 15, block_size=32, generator=np.random.RandomState(2))
+        b = TruncatedNormalSampler(10, 4, 5, 15, block_size=32, generator=np.random.RandomState(2))
+        values = [a() for _ in range(50)] + a.sample(70).tolist() + [a() for _ in range(3)]
+        self.assertEqual(values, b.sample(123).tolist())
+
+    def test_empty_interval(self):
+        with self.assertRaises(ValueError):
+            TruncatedNormalSampler(10, 4, 15, 5)
@@ -0,0 +1,29 @@
+import unittest
+
+from src.simulator.scheduler import TimingWheel
+
+
+class TestTimingWheel(unittest.TestCase):
+
+    def test_wake_up(self):
+        wheel = TimingWheel(4)
+        wheel.schedule("b", 2, 2)
+        wheel.schedule("a", 1, 2)
+        wheel.schedule("c", 3, 1)
+        wheel.schedule("never", 4, 0)
+        self.assertEqual(len(wheel), 3, "Items with no delay must not be stored")
+        self.assertEqual(wheel.advance(), ["c"])
+        self.assertEqual(wheel.advance(), ["a", "b"], "The items are not sorted by their key")
+        self.assertEqual(wheel.advance(), [])
+        self.assertEqual(len(wheel), 0)
+
+    def test_resize(self):
+        wheel = TimingWheel(3)
+        wheel.advance()
+        wheel.schedule("a", 1, 2)
+        wheel.schedule("b", 2, 10)
+        steps = {}
+        for step in range(1, 12):
+            for item in wheel.advance():
+                steps[item] = step
+        self.assertEqual(steps, {"a": 2, "b": 10}, "The items are woken up at a wrong step after resizing")
@@ -0,0 +1,15 @@
+import unittest
+
+from src.models.station import Station
+
+
+class TestStation(unittest.TestCase):
+
+    def test_queueing_time(self):
+        station = Station((0, 0), 1)
+        station.enqueue("a", 3)
+        station.enqueue("b", 4)
+        self.assertEqual(station.occupation(), 2)
+        self.assertEqual(station.dequeue(3), ("a", 1), "A vehicle dequeued in the same step has queued one step")
+        self.assertEqual(station.dequeue(10), ("b", 7))
+        self.assertEqual(len(station.queue_tsteps), 0)
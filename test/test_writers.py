@@ -0,0 +1,50 @@
+import unittest
+
+import os
+import tempfile
+
+import h5py
+import numpy as np
+
+from src.metrics.writers import BackgroundWriter, StreamWriter
+
+
+class TestStreamWriter(unittest.TestCase):
+
+    def test_append(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "results.hdf5")
+            with h5py.File(filename, "w") as f:
+                background = BackgroundWriter(max_pending=2)
+                writer = background.wrap(StreamWriter(f, "/0/", chunk_size=4))
+                for block in range(10):
+                    writer.append("series", list(range(3*block, 3*block + 3)), "uint32")
+                writer.append("empty", [], "float32")
+                writer.write("matrix", np.eye(3), "uint32")
+                writer.flush()
+                background.close()
+
+            with h5py.File(filename, "r") as f:
+                self.assertEqual(f["/0/series"][()].tolist(), list(range(30)), "The blocks are not appended in order")
+                self.assertEqual(f["/0/series"].chunks, (4,))
+                self.assertEqual(f["/0/empty"].shape, (0,))
+                self.assertEqual(f["/0/matrix"][()].tolist(), np.eye(3).tolist())
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def test_error(self):
+        done = []
+
+        def fail():
+            raise ValueError("No space left")
+
+        background = BackgroundWriter()
+        background.put(done.append, 1)
+        background.put(fail)
+        background.put(done.append, 2)
+        with self.assertRaises(RuntimeError) as context:
+            background.close()
+        self.assertIsInstance(context.exception.__cause__, ValueError, "The error is not propagated")
+        self.assertEqual(done, [1], "The calls after the error are not discarded")
+        background.close()